@@ -1,23 +1,6 @@
-const { Pool } = require('pg');
+const { query } = require('./db');
 const bcrypt = require('bcryptjs');
 
-// Database connection
-const pool = new Pool({
-  connectionString: process.env.DATABASE_URL,
-  ssl: false
-});
-
-// Helper function to execute queries
-async function query(text, params) {
-  const client = await pool.connect();
-  try {
-    const result = await client.query(text, params);
-    return result;
-  } finally {
-    client.release();
-  }
-}
-
 async function handler(req, res) {
   try {
     if (req.method === 'POST') {
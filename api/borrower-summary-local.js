@@ -1,21 +1,5 @@
-const { Pool } = require('pg');
-
-// Database connection
-const pool = new Pool({
-  connectionString: process.env.DATABASE_URL,
-  ssl: false
-});
-
-// Helper function to execute queries
-async function query(text, params) {
-  const client = await pool.connect();
-  try {
-    const result = await client.query(text, params);
-    return result;
-  } finally {
-    client.release();
-  }
-}
+const { query } = require('./db');
+const { sendCached } = require('./cache');
 
 async function handler(req, res) {
   try {
@@ -35,23 +19,22 @@ async function handler(req, res) {
         return res.status(403).json({ error: 'Access denied' });
       }
       
-      // Get loans for the borrower
-      const loansResult = await query('SELECT * FROM loans WHERE borrower_id = $1 ORDER BY id DESC', [borrowerId]);
-      const loans = loansResult.rows;
-      
-      // Get all payments for this borrower's loans
-      const loanIds = loans.map(loan => loan.id);
-      let payments = [];
-      
-      if (loanIds.length > 0) {
-        const placeholders = loanIds.map((_, index) => `$${index + 1}`).join(',');
-        const paymentsResult = await query(`SELECT * FROM payments WHERE loan_id IN (${placeholders}) ORDER BY loan_id, week`, loanIds);
-        payments = paymentsResult.rows;
-      }
-      
-      res.json({
-        loans,
-        payments
+      // Same borrower, same body: cached per borrower until the next write
+      await sendCached(req, res, `borrower-summary:${borrowerId}`, async () => {
+        // Get loans for the borrower
+        const loansResult = await query('SELECT * FROM loans WHERE borrower_id = $1 ORDER BY id DESC', [borrowerId]);
+        const loans = loansResult.rows;
+
+        // Get all payments for this borrower's loans
+        const loanIds = loans.map(loan => loan.id);
+        let payments = [];
+
+        if (loanIds.length > 0) {
+          const paymentsResult = await query('SELECT * FROM payments WHERE loan_id = ANY($1::int[]) ORDER BY loan_id, week', [loanIds]);
+          payments = paymentsResult.rows;
+        }
+
+        return { data: { loans, payments } };
       });
 
     } else {
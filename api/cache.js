@@ -0,0 +1,93 @@
+const crypto = require('crypto');
+const { query, prepared } = require('./db');
+
+// Serialized GET responses keyed by URL, reused while the data version is
+// unchanged. Every transaction that writes loans or payments bumps
+// data_version (database triggers), so one primary key read tells whether a
+// cached body is still current - whichever process made the write.
+const MAX_ENTRIES = parseInt(process.env.CACHE_MAX_ENTRIES) || 500;
+const MAX_BYTES = parseInt(process.env.CACHE_MAX_BYTES) || 64 * 1024 * 1024;
+
+// Map iteration order is insertion order, so re-inserting on a hit keeps
+// the least recently used entry first
+const entries = new Map();
+let cachedBytes = 0;
+const counters = { hits: 0, misses: 0, not_modified: 0 };
+
+async function dataVersion() {
+  const result = await prepared('dataVersion', []);
+  return parseInt(result.rows[0].version);
+}
+
+function evict(key) {
+  const entry = entries.get(key);
+  if (entry) {
+    cachedBytes -= entry.body.length;
+    entries.delete(key);
+  }
+}
+
+function store(key, entry) {
+  evict(key);
+  if (entry.body.length > MAX_BYTES) return;
+  entries.set(key, entry);
+  cachedBytes += entry.body.length;
+  while (entries.size > MAX_ENTRIES || cachedBytes > MAX_BYTES) {
+    evict(entries.keys().next().value);
+  }
+}
+
+// Send build()'s JSON for this key, from the cache while the data version is
+// unchanged. The ETag hashes the body, so a client whose copy is still
+// identical gets a bodiless 304 even after writes to unrelated rows.
+// build() returns { data, headers } (headers optional).
+async function sendCached(req, res, key, build) {
+  const version = await dataVersion();
+  let entry = entries.get(key);
+  if (entry && entry.version === version) {
+    entries.delete(key);
+    entries.set(key, entry);
+    counters.hits++;
+  } else {
+    counters.misses++;
+    const { data, headers = {} } = await build();
+    const body = Buffer.from(JSON.stringify(data));
+    const hash = crypto.createHash('sha1').update(body).digest('base64url').slice(0, 16);
+    entry = { version, etag: `"${hash}"`, body, headers };
+    store(key, entry);
+  }
+
+  res.set(entry.headers);
+  res.set('ETag', entry.etag);
+  res.set('X-Data-Version', String(entry.version));
+  res.set('Cache-Control', 'private, no-cache');
+  if (req.headers['if-none-match'] === entry.etag) {
+    counters.not_modified++;
+    return res.status(304).end();
+  }
+  res.status(200).type('application/json').send(entry.body);
+}
+
+// Rows of loans or payments written after sinceVersion, plus the ids deleted
+// since. full is set (with every row) when the client's version is ahead of
+// the database, e.g. after a restore, or older than the tombstones still kept
+// (prune_deleted_rows() in database/init.sql).
+async function changesSince(table, sinceVersion, columns = '*') {
+  const { rows: [current] } = await query('SELECT version, deleted_horizon FROM data_version');
+  const version = parseInt(current.version);
+  if (sinceVersion > version || sinceVersion < parseInt(current.deleted_horizon)) {
+    const result = await query(`SELECT ${columns} FROM ${table} ORDER BY id`);
+    return { version, full: true, rows: result.rows, deleted: [] };
+  }
+  const [rows, deleted] = await Promise.all([
+    query(`SELECT ${columns} FROM ${table} WHERE version > $1 ORDER BY id`, [sinceVersion]),
+    query('SELECT row_id FROM deleted_rows WHERE table_name = $1 AND version > $2 ORDER BY row_id', [table, sinceVersion])
+  ]);
+  return { version, full: false, rows: rows.rows, deleted: deleted.rows.map(row => row.row_id) };
+}
+
+function cacheStats() {
+  return { entries: entries.size, bytes: cachedBytes, max_entries: MAX_ENTRIES, max_bytes: MAX_BYTES, ...counters };
+}
+
+module.exports = { sendCached, changesSince, dataVersion, cacheStats };
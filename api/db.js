@@ -0,0 +1,127 @@
+const { Pool, Client } = require('pg');
+const { statementLabel, dbQuerySeconds, dbSlowQueries } = require('./metrics');
+
+const CONNECTION = {
+  connectionString: process.env.DATABASE_URL,
+  ssl: false, // Disable SSL for local development
+  connectionTimeoutMillis: parseInt(process.env.DB_CONNECT_TIMEOUT_MS) || 5000,
+  statement_timeout: parseInt(process.env.DB_STATEMENT_TIMEOUT_MS) || 15000
+};
+
+// Shared database pool for every API handler and the session store, so one
+// process holds a single bounded set of Postgres connections.
+const pool = new Pool({
+  ...CONNECTION,
+  max: parseInt(process.env.DB_POOL_MAX) || 10,
+  idleTimeoutMillis: parseInt(process.env.DB_IDLE_TIMEOUT_MS) || 30000
+});
+
+pool.on('error', (error) => {
+  console.error('Idle database client error:', error);
+});
+
+// Statements at least this slow are logged with their SQL
+const SLOW_QUERY_MS = parseInt(process.env.DB_SLOW_QUERY_MS) || 200;
+
+// Hot queries run as named statements, so each connection parses and plans
+// them once and reuses the plan afterwards.
+const PREPARED = {
+  loanById: 'SELECT * FROM loans WHERE id = $1',
+  paymentsByLoan: 'SELECT * FROM payments WHERE loan_id = $1 ORDER BY week',
+  paymentByLoanWeek: 'SELECT * FROM payments WHERE loan_id = $1 AND week = $2',
+  dataVersion: 'SELECT version FROM data_version'
+};
+
+// Checkout wait times, exposed on /health
+const waits = { count: 0, totalMs: 0, maxMs: 0 };
+
+async function connect() {
+  const start = process.hrtime.bigint();
+  const client = await pool.connect();
+  const waitMs = Number(process.hrtime.bigint() - start) / 1e6;
+  waits.count++;
+  waits.totalMs += waitMs;
+  waits.maxMs = Math.max(waits.maxMs, waitMs);
+  return client;
+}
+
+// Run one statement on client, feeding the query timings on /metrics and
+// logging it when slow. text is SQL or a { name, text, values } config.
+async function timedQuery(client, text, params) {
+  const sql = typeof text === 'string' ? text : text.text;
+  const start = process.hrtime.bigint();
+  try {
+    return await client.query(text, params);
+  } finally {
+    const ms = Number(process.hrtime.bigint() - start) / 1e6;
+    const label = statementLabel(sql);
+    dbQuerySeconds.observe([label], ms / 1000);
+    if (ms >= SLOW_QUERY_MS) {
+      dbSlowQueries.inc([label]);
+      console.warn(`Slow query (${ms.toFixed(1)} ms): ${sql.replace(/\s+/g, ' ').trim().slice(0, 500)}`);
+    }
+  }
+}
+
+// Helper function to execute queries
+async function query(text, params) {
+  const client = await connect();
+  try {
+    const result = await timedQuery(client, text, params);
+    return result;
+  } finally {
+    client.release();
+  }
+}
+
+// Execute one of the PREPARED statements by name
+async function prepared(name, params) {
+  return query({ name, text: PREPARED[name], values: params });
+}
+
+// A connection outside the pool, for work that holds one for as long as a
+// client takes to download (streamed exports). The caller ends it.
+async function dedicatedClient() {
+  const client = new Client(CONNECTION);
+  await client.connect();
+  return client;
+}
+
+// Run fn(client) inside BEGIN/COMMIT, rolling back if it throws. fn's
+// client.query calls are timed like query(). dedicated runs it on a
+// connection of its own instead of a pooled one.
+async function transaction(fn, { dedicated = false } = {}) {
+  const client = dedicated ? await dedicatedClient() : await connect();
+  const timed = Object.create(client);
+  timed.query = (text, params) => timedQuery(client, text, params);
+  try {
+    await client.query('BEGIN');
+    const result = await fn(timed);
+    await client.query('COMMIT');
+    return result;
+  } catch (error) {
+    await client.query('ROLLBACK');
+    throw error;
+  } finally {
+    if (dedicated) {
+      await client.end();
+    } else {
+      client.release();
+    }
+  }
+}
+
+function poolStats() {
+  return {
+    max: pool.options.max,
+    total: pool.totalCount,
+    active: pool.totalCount - pool.idleCount,
+    idle: pool.idleCount,
+    waiting: pool.waitingCount,
+    checkouts: waits.count,
+    wait_avg_ms: waits.count ? +(waits.totalMs / waits.count).toFixed(3) : 0,
+    wait_max_ms: +waits.maxMs.toFixed(3)
+  };
+}
+
+module.exports = { pool, query, prepared, transaction, poolStats };
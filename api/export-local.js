@@ -0,0 +1,120 @@
+const zlib = require('zlib');
+const { once } = require('events');
+const { transaction } = require('./db');
+
+// Rows per FETCH from the server-side cursor; memory stays bounded by this
+// batch no matter how large the book is
+const FETCH_SIZE = 1000;
+
+// Each export holds a connection of its own (outside DB_POOL_MAX) for as long
+// as the download takes, so only this many run at once; more get a 503
+const EXPORT_MAX_CONCURRENT = parseInt(process.env.EXPORT_MAX_CONCURRENT) || 2;
+let activeExports = 0;
+
+// Export rows from database/init.sql, shared with pgstore.py: one per loan as
+// the dashboard table shows it, or one per scheduled week with its payment
+const LOANS_EXPORT_SQL = 'SELECT * FROM loan_export ORDER BY loan_id';
+const WEEKS_EXPORT_SQL = 'SELECT * FROM installment_export(CURRENT_DATE)';
+
+const EXPORT_SQL = { loans: LOANS_EXPORT_SQL, weeks: WEEKS_EXPORT_SQL };
+
+// [row key, CSV header] per view
+const EXPORT_COLUMNS = {
+  loans: [
+    ['loan_id', 'Loan ID'], ['borrower_id', 'Borrower ID'], ['borrower', 'Borrower'], ['amount', 'Amount'],
+    ['start_date', 'Start Date'], ['interest', 'Interest %'], ['weeks', 'Weeks'], ['paid_weeks', 'Paid Weeks'],
+    ['remaining_weeks', 'Remaining Weeks'], ['total_paid', 'Total Paid'], ['remaining_amount', 'Remaining Amount'],
+    ['installment', 'Weekly Installment'], ['next_due_date', 'Next Due Date'], ['status', 'Completion Status']
+  ],
+  weeks: [
+    ['loan_id', 'Loan ID'], ['borrower_id', 'Borrower ID'], ['borrower', 'Borrower'], ['amount', 'Amount'],
+    ['interest', 'Interest %'], ['weeks', 'Weeks'], ['start_date', 'Start Date'], ['week', 'Week'],
+    ['due_date', 'Due Date'], ['installment', 'Installment'], ['status', 'Status'],
+    ['paid_amount', 'Paid Amount'], ['paid_date', 'Paid Date']
+  ]
+};
+
+function csvField(value) {
+  if (value === null || value === undefined) return '';
+  const text = String(value);
+  return /[",\r\n]/.test(text) ? `"${text.replace(/"/g, '""')}"` : text;
+}
+
+async function handler(req, res) {
+  if (req.method !== 'GET') {
+    return res.status(405).json({ error: 'Method not allowed' });
+  }
+
+  const format = req.query.format || 'csv';
+  const view = req.query.view || 'loans';
+  if (!['csv', 'ndjson'].includes(format)) {
+    return res.status(400).json({ error: 'format must be csv or ndjson' });
+  }
+  if (!EXPORT_SQL[view]) {
+    return res.status(400).json({ error: 'view must be loans or weeks' });
+  }
+
+  if (activeExports >= EXPORT_MAX_CONCURRENT) {
+    res.set('Retry-After', '30');
+    return res.status(503).json({ error: 'Too many exports in progress, try again shortly' });
+  }
+
+  const columns = EXPORT_COLUMNS[view];
+  const formatRow = format === 'csv'
+    ? row => columns.map(([key]) => csvField(row[key])).join(',') + '\n'
+    : row => JSON.stringify(row) + '\n';
+
+  // No Content-Length: the body goes out with chunked transfer encoding
+  const today = new Date().toISOString().split('T')[0];
+  res.status(200);
+  res.set('Content-Type', format === 'csv' ? 'text/csv; charset=utf-8' : 'application/x-ndjson');
+  res.set('Content-Disposition', `attachment; filename="${view}_export_${today}.${format}"`);
+  res.set('Vary', 'Accept-Encoding');
+  let out = res;
+  if (req.acceptsEncodings('gzip')) {
+    res.set('Content-Encoding', 'gzip');
+    out = zlib.createGzip();
+    out.pipe(res);
+  }
+
+  // Aborts a wait for 'drain' when the client goes away
+  const disconnected = new AbortController();
+  res.on('close', () => disconnected.abort());
+
+  activeExports++;
+  try {
+    await transaction(async (client) => {
+      await client.query(`DECLARE export_cursor NO SCROLL CURSOR FOR ${EXPORT_SQL[view]}`);
+      if (format === 'csv') {
+        out.write(columns.map(([, header]) => header).join(',') + '\n');
+      }
+      while (!disconnected.signal.aborted) {
+        const { rows } = await client.query(`FETCH ${FETCH_SIZE} FROM export_cursor`);
+        if (rows.length === 0) break;
+        // Wait for the client to catch up before fetching more; once()
+        // removes its listeners whichever way the wait ends
+        if (!out.write(rows.map(formatRow).join(''))) {
+          await once(out, 'drain', { signal: disconnected.signal }).catch(error => {
+            if (error.name !== 'AbortError') throw error;
+          });
+        }
+      }
+    }, { dedicated: true });
+    out.end();
+
+  } catch (error) {
+    console.error('Export API Error:', error);
+    if (!res.headersSent) {
+      if (out !== res) out.unpipe(res);
+      res.removeHeader('Content-Encoding');
+      res.removeHeader('Content-Disposition');
+      return res.status(500).json({ error: error.message });
+    }
+    // Part of the file is already out; cut the download short
+    res.destroy(error);
+  } finally {
+    activeExports--;
+  }
+}
+
+module.exports = { handler };
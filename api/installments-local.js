@@ -0,0 +1,62 @@
+const { query } = require('./db');
+const { sendCached } = require('./cache');
+
+// Unpaid installments due by a date, one page plus the count and amount of
+// all of them; due_installments() in database/init.sql, shared with pgstore.py
+const DUE_INSTALLMENTS_SQL = 'SELECT * FROM due_installments($1, $2, $3, $4, $5)';
+
+const DEFAULT_LIMIT = 100;
+const MAX_LIMIT = 1000;
+
+async function handler(req, res) {
+  try {
+    if (!req.session.user) {
+      return res.status(401).json({ error: 'Authentication required' });
+    }
+
+    if (req.method === 'GET' && req.path === '/due') {
+      const until = req.query.until;
+      if (!until || !/^\d{4}-\d{2}-\d{2}$/.test(until)) {
+        return res.status(400).json({ error: 'until date required (YYYY-MM-DD)' });
+      }
+
+      let borrowerId = req.query.borrower_id || null;
+      // Users can only see their own installments
+      if (req.session.user.role === 'user') {
+        if (borrowerId && borrowerId !== req.session.user.username) {
+          return res.status(403).json({ error: 'Access denied' });
+        }
+        borrowerId = req.session.user.username;
+      }
+
+      const q = req.query.q ? req.query.q.trim() : null;
+      const limit = Math.min(parseInt(req.query.limit) || DEFAULT_LIMIT, MAX_LIMIT);
+      const offset = Math.max(parseInt(req.query.offset) || 0, 0);
+
+      // Keyed by the effective borrower too, since users get theirs implicitly
+      await sendCached(req, res, `${req.originalUrl}|${borrowerId || ''}`, async () => {
+        const result = await query(DUE_INSTALLMENTS_SQL, [until, q, borrowerId, limit, offset]);
+        const first = result.rows[0];
+
+        return {
+          data: {
+            rows: result.rows.map(({ total_count, total_amount, ...row }) => row),
+            total: first ? parseInt(first.total_count) : 0,
+            total_amount: first ? first.total_amount : '0',
+            limit,
+            offset
+          }
+        };
+      });
+
+    } else {
+      res.status(405).json({ error: 'Method not allowed' });
+    }
+
+  } catch (error) {
+    console.error('Installments API Error:', error);
+    res.status(500).json({ error: error.message });
+  }
+}
+
+module.exports = { handler };
@@ -1,41 +1,110 @@
-const { Pool } = require('pg');
+const { query, prepared } = require('./db');
+const { sendCached, changesSince } = require('./cache');
+const { parseIds, parseId, parseLimit, selectColumns, loanSearchCondition } = require('./params');
 
-// Database connection
-const pool = new Pool({
-  connectionString: process.env.DATABASE_URL,
-  ssl: false // Disable SSL for local development
-});
+const LOAN_FIELDS = ['id', 'borrower_id', 'borrower', 'amount', 'interest', 'weeks', 'start_date', 'version', 'created_at', 'updated_at'];
+const MAX_LIMIT = 1000;
 
-// Helper function to execute queries
-async function query(text, params) {
-  const client = await pool.connect();
-  try {
-    const result = await client.query(text, params);
-    return result;
-  } finally {
-    client.release();
-  }
+// Installment amounts divide by weeks, so a loan runs at least one week
+const WEEKS_ERROR = 'weeks must be a positive integer';
+function validWeeks(weeks) {
+  return Number.isInteger(Number(weeks)) && Number(weeks) >= 1;
 }
 
 async function handler(req, res) {
   try {
     if (req.method === 'GET') {
-      // Get all loans or specific loan by ID
-      if (req.params && req.params.id) {
-        const result = await query('SELECT * FROM loans WHERE id = $1', [req.params.id]);
+      // Get all loans or specific loan by ID (/api/loans/5 reaches the mount as /5)
+      const byId = /^\/(\d+)$/.exec(req.path);
+      if (byId) {
+        const result = await prepared('loanById', [parseInt(byId[1])]);
         if (result.rows.length === 0) {
           return res.status(404).json({ error: 'Loan not found' });
         }
         res.status(200).json(result.rows[0]);
       } else {
-        const result = await query('SELECT * FROM loans ORDER BY id DESC');
-        res.status(200).json(result.rows);
+        // Newest first; after_id/limit page through with a keyset cursor
+        const { after_id, limit, borrower_id, q, start_from, start_to, ids, fields, since_version } = req.query;
+        const columns = selectColumns(fields, LOAN_FIELDS);
+        if (!columns) {
+          return res.status(400).json({ error: 'Unknown field requested' });
+        }
+
+        // Delta mode: only loans written, and ids deleted, since the client's version
+        if (since_version !== undefined) {
+          const sinceVersion = Number(since_version);
+          if (!Number.isInteger(sinceVersion) || sinceVersion < 0) {
+            return res.status(400).json({ error: 'since_version must be a non-negative integer' });
+          }
+          return sendCached(req, res, req.originalUrl, async () => ({
+            data: await changesSince('loans', sinceVersion, columns)
+          }));
+        }
+
+        const conditions = [];
+        const params = [];
+        if (after_id) {
+          const afterId = parseId(after_id);
+          if (afterId === null) {
+            return res.status(400).json({ error: 'after_id must be an integer' });
+          }
+          params.push(afterId);
+          conditions.push(`id < $${params.length}`);
+        }
+        if (borrower_id) {
+          params.push(borrower_id);
+          conditions.push(`borrower_id = $${params.length}`);
+        }
+        if (q) {
+          params.push(`%${q.trim()}%`);
+          conditions.push(loanSearchCondition(`$${params.length}`));
+        }
+        if (start_from) {
+          params.push(start_from);
+          conditions.push(`start_date >= $${params.length}`);
+        }
+        if (start_to) {
+          params.push(start_to);
+          conditions.push(`start_date <= $${params.length}`);
+        }
+        if (ids) {
+          const idList = parseIds(ids);
+          if (!idList) {
+            return res.status(400).json({ error: 'ids must be comma separated integers' });
+          }
+          params.push(idList);
+          conditions.push(`id = ANY($${params.length}::int[])`);
+        }
+
+        let sql = `SELECT ${columns} FROM loans`;
+        if (conditions.length > 0) sql += ` WHERE ${conditions.join(' AND ')}`;
+        sql += ' ORDER BY id DESC';
+        const pageSize = limit ? parseLimit(limit, MAX_LIMIT) : null;
+        if (limit && pageSize === null) {
+          return res.status(400).json({ error: `limit must be an integer from 1 to ${MAX_LIMIT}` });
+        }
+        if (pageSize) {
+          params.push(pageSize);
+          sql += ` LIMIT $${params.length}`;
+        }
+
+        await sendCached(req, res, req.originalUrl, async () => {
+          const result = await query(sql, params);
+          const headers = {};
+          if (pageSize && result.rows.length === pageSize) {
+            headers['X-Next-After-Id'] = String(result.rows[result.rows.length - 1].id);
+          }
+          return { data: result.rows, headers };
+        });
       }
 
     } else if (req.method === 'POST') {
       // Create new loan
       const { borrower_id, borrower, amount, interest, weeks, start_date } = req.body;
-      
+      if (!validWeeks(weeks)) {
+        return res.status(400).json({ error: WEEKS_ERROR });
+      }
+
       const result = await query(
         'INSERT INTO loans (borrower_id, borrower, amount, interest, weeks, start_date) VALUES ($1, $2, $3, $4, $5, $6) RETURNING *',
         [borrower_id, borrower, amount, interest, weeks, start_date]
@@ -47,6 +116,9 @@ async function handler(req, res) {
       // Update loan
       const loanId = req.url.split('/').pop();
       const { borrower_id, borrower, amount, interest, weeks, start_date } = req.body;
+      if (!validWeeks(weeks)) {
+        return res.status(400).json({ error: WEEKS_ERROR });
+      }
 
       if (loanId) {
         const result = await query(
@@ -0,0 +1,140 @@
+// Request and query metrics, kept in process memory and rendered in the
+// Prometheus text format on GET /metrics. The metric names match metrics.py,
+// so one dashboard covers both services.
+
+// Upper bounds in seconds, 1 ms to 10 s
+const LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10];
+
+function escapeLabel(value) {
+  return String(value).replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n');
+}
+
+function labelText(names, values, extra) {
+  const pairs = names.map((name, i) => `${name}="${escapeLabel(values[i])}"`);
+  if (extra) pairs.push(extra);
+  return pairs.length ? `{${pairs.join(',')}}` : '';
+}
+
+class Counter {
+  constructor(name, help, labelNames = []) {
+    Object.assign(this, { name, help, labelNames, kind: 'counter' });
+    this.values = new Map(); // JSON label values -> total
+  }
+
+  inc(labels = [], amount = 1) {
+    const key = JSON.stringify(labels);
+    this.values.set(key, (this.values.get(key) || 0) + amount);
+  }
+
+  samples() {
+    return [...this.values].sort().map(([key, value]) =>
+      `${this.name}${labelText(this.labelNames, JSON.parse(key))} ${value}`);
+  }
+}
+
+class Histogram {
+  constructor(name, help, labelNames = [], buckets = LATENCY_BUCKETS) {
+    Object.assign(this, { name, help, labelNames, buckets, kind: 'histogram' });
+    this.series = new Map(); // JSON label values -> { counts per bucket + overflow, sum }
+  }
+
+  observe(labels, value) {
+    const key = JSON.stringify(labels);
+    let series = this.series.get(key);
+    if (!series) {
+      series = { counts: new Array(this.buckets.length + 1).fill(0), sum: 0 };
+      this.series.set(key, series);
+    }
+    const index = this.buckets.findIndex(bound => value <= bound);
+    series.counts[index === -1 ? this.buckets.length : index]++;
+    series.sum += value;
+  }
+
+  samples() {
+    const lines = [];
+    for (const [key, { counts, sum }] of [...this.series].sort()) {
+      const labels = JSON.parse(key);
+      let cumulative = 0;
+      [...this.buckets, '+Inf'].forEach((bound, i) => {
+        cumulative += counts[i];
+        lines.push(`${this.name}_bucket${labelText(this.labelNames, labels, `le="${bound}"`)} ${cumulative}`);
+      });
+      lines.push(`${this.name}_sum${labelText(this.labelNames, labels)} ${sum}`);
+      lines.push(`${this.name}_count${labelText(this.labelNames, labels)} ${cumulative}`);
+    }
+    return lines;
+  }
+}
+
+const requestSeconds = new Histogram('http_request_duration_seconds',
+  'Time from receiving a request to sending the last byte of its response', ['method', 'route', 'status']);
+const requestBytes = new Counter('http_request_bytes_total', 'Request body bytes received', ['method', 'route']);
+const responseBytes = new Counter('http_response_bytes_total', 'Response body bytes sent', ['method', 'route']);
+const dbQuerySeconds = new Histogram('db_query_duration_seconds', 'Database statement execution time', ['statement']);
+const dbSlowQueries = new Counter('db_slow_queries_total', 'Statements slower than DB_SLOW_QUERY_MS', ['statement']);
+
+const METRICS = [requestSeconds, requestBytes, responseBytes, dbQuerySeconds, dbSlowQueries];
+
+// All metrics in the Prometheus text exposition format
+function render() {
+  const lines = [];
+  for (const metric of METRICS) {
+    lines.push(`# HELP ${metric.name} ${metric.help}`, `# TYPE ${metric.name} ${metric.kind}`, ...metric.samples());
+  }
+  return lines.join('\n') + '\n';
+}
+
+// A short label with bounded cardinality for a statement: its verb and
+// first table, e.g. "select loans" or "insert payments"
+function statementLabel(sql) {
+  const verb = /^\s*([a-z]*)/i.exec(sql)[1].toLowerCase();
+  const table = /\b(?:from|into|update)\s+([a-z_][a-z0-9_]*)/i.exec(sql);
+  return table ? `${verb} ${table[1].toLowerCase()}` : verb;
+}
+
+// Route template for a request, never the raw path: mounted API handlers are
+// labelled by mount point with numeric ids folded (/api/payments/:id)
+function routeLabel(req, res) {
+  if (req.route) return req.baseUrl + req.route.path;
+  if (req.baseUrl) return req.baseUrl + req.path.replace(/\/\d+(?=\/|$)/g, '/:id').replace(/\/$/, '');
+  return res.statusCode < 400 ? 'static' : 'unmatched';
+}
+
+function byteLength(chunk, encoding) {
+  if (!chunk || typeof chunk === 'function') return 0;
+  return typeof chunk === 'string'
+    ? Buffer.byteLength(chunk, typeof encoding === 'string' ? encoding : 'utf8')
+    : chunk.length;
+}
+
+// Middleware timing each request until its response is finished (so streamed
+// exports are measured in full) and counting body bytes both ways
+function instrument(req, res, next) {
+  const start = process.hrtime.bigint();
+  let sent = 0;
+  const { write, end } = res;
+  res.write = function (chunk, encoding, ...rest) {
+    sent += byteLength(chunk, encoding);
+    return write.call(this, chunk, encoding, ...rest);
+  };
+  res.end = function (chunk, encoding, ...rest) {
+    sent += byteLength(chunk, encoding);
+    return end.call(this, chunk, encoding, ...rest);
+  };
+
+  let recorded = false;
+  const record = () => {
+    if (recorded) return;
+    recorded = true;
+    const route = routeLabel(req, res);
+    const seconds = Number(process.hrtime.bigint() - start) / 1e9;
+    requestSeconds.observe([req.method, route, String(res.statusCode)], seconds);
+    requestBytes.inc([req.method, route], parseInt(req.headers['content-length']) || 0);
+    responseBytes.inc([req.method, route], sent);
+  };
+  res.on('finish', record);
+  res.on('close', record);
+  next();
+}
+
+module.exports = { render, instrument, statementLabel, dbQuerySeconds, dbSlowQueries };
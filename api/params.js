@@ -0,0 +1,39 @@
+// Query string helpers shared by the list endpoints (loans, payments)
+
+// Parse a comma separated id list such as ?ids=1,2,3 (null if malformed)
+function parseIds(value) {
+  const ids = String(value).split(',').filter(part => part.trim() !== '').map(Number);
+  return ids.every(Number.isInteger) ? ids : null;
+}
+
+// Parse a keyset cursor such as ?after_id=42 (null if not an integer)
+function parseId(value) {
+  const id = Number(value);
+  return String(value).trim() !== '' && Number.isInteger(id) ? id : null;
+}
+
+// Parse a page size such as ?limit=100 (null unless an integer from 1 to max)
+function parseLimit(value, max) {
+  const limit = parseId(value);
+  return limit !== null && limit >= 1 && limit <= max ? limit : null;
+}
+
+// Column list for ?fields= projection, always including id (null if unknown field)
+function selectColumns(fields, allowed) {
+  if (!fields) return '*';
+  const names = String(fields).split(',').map(name => name.trim()).filter(Boolean);
+  if (names.some(name => !allowed.includes(name))) return null;
+  if (!names.includes('id')) names.unshift('id');
+  return names.join(', ');
+}
+
+// Condition matching loans whose borrower id, name or loan id contains ?q=,
+// with the %term% pattern bound at placeholder. Each of the three terms has a
+// trigram index in database/init.sql (id::text included), so Postgres can
+// combine them instead of scanning every loan
+function loanSearchCondition(placeholder, alias = '') {
+  const column = name => (alias ? `${alias}.${name}` : name);
+  return `(${column('borrower_id')} ILIKE ${placeholder} OR ${column('borrower')} ILIKE ${placeholder} OR ${column('id')}::text LIKE ${placeholder})`;
+}
+
+module.exports = { parseIds, parseId, parseLimit, selectColumns, loanSearchCondition };
@@ -1,50 +1,228 @@
-const { Pool } = require('pg');
+const { query, prepared, transaction } = require('./db');
+const { sendCached, changesSince } = require('./cache');
+const { parseIds, parseId, parseLimit, selectColumns, loanSearchCondition } = require('./params');
 
-// Database connection
-const pool = new Pool({
-  connectionString: process.env.DATABASE_URL,
-  ssl: false // Disable SSL for local development
-});
+const PAYMENT_FIELDS = ['id', 'loan_id', 'week', 'amount', 'date', 'version', 'created_at', 'updated_at'];
+const MAX_LIMIT = 1000;
 
-// Helper function to execute queries
-async function query(text, params) {
-  const client = await pool.connect();
-  try {
-    const result = await client.query(text, params);
-    return result;
-  } finally {
-    client.release();
+// Rows per INSERT statement when a bulk upload is split into batches
+const BULK_BATCH_SIZE = 5000;
+
+// Insert a batch with one statement; weeks that are already paid are skipped
+const BULK_INSERT_SQL = `
+  INSERT INTO payments (loan_id, week, amount, date)
+  SELECT * FROM unnest($1::int[], $2::int[], $3::numeric[], $4::date[])
+  ON CONFLICT (loan_id, week) DO NOTHING
+  RETURNING *
+`;
+
+// Existing rows for (loan_id, week) pairs that the insert skipped
+const BULK_EXISTING_SQL = `
+  SELECT p.* FROM payments p
+  JOIN unnest($1::int[], $2::int[]) AS k(loan_id, week)
+    ON p.loan_id = k.loan_id AND p.week = k.week
+`;
+
+// The first payment whose week is past the end of its loan, if any
+const BULK_WEEK_PAST_LOAN_SQL = `
+  SELECT k.loan_id, k.week, l.weeks FROM unnest($1::int[], $2::int[]) AS k(loan_id, week)
+  JOIN loans l ON l.id = k.loan_id
+  WHERE k.week > l.weeks
+  LIMIT 1
+`;
+
+// Bulk bodies are a JSON array, {"payments": [...]} / {"ids": [...]}, or NDJSON text
+function parseBulkBody(body, key) {
+  if (typeof body === 'string') {
+    return body.split('\n').filter(line => line.trim() !== '').map(line => JSON.parse(line));
   }
+  if (Array.isArray(body)) return body;
+  if (body && Array.isArray(body[key])) return body[key];
+  return null;
+}
+
+async function bulkInsert(payments) {
+  const today = new Date().toISOString().split('T')[0];
+  return transaction(async (client) => {
+    const pastLoan = await client.query(BULK_WEEK_PAST_LOAN_SQL, [payments.map(p => p.loan_id), payments.map(p => p.week)]);
+    if (pastLoan.rows.length > 0) {
+      const { loan_id, week, weeks } = pastLoan.rows[0];
+      throw Object.assign(new Error(`Week ${week} is outside loan ${loan_id} (weeks 1-${weeks})`), { status: 400 });
+    }
+    const rows = [];
+    let inserted = 0;
+    for (let start = 0; start < payments.length; start += BULK_BATCH_SIZE) {
+      const batch = payments.slice(start, start + BULK_BATCH_SIZE);
+      const loanIds = batch.map(p => p.loan_id);
+      const weeks = batch.map(p => p.week);
+      const result = await client.query(BULK_INSERT_SQL, [
+        loanIds,
+        weeks,
+        batch.map(p => p.amount),
+        batch.map(p => p.date || today)
+      ]);
+      inserted += result.rows.length;
+      if (result.rows.length === batch.length) {
+        rows.push(...result.rows);
+      } else {
+        const existing = await client.query(BULK_EXISTING_SQL, [loanIds, weeks]);
+        rows.push(...existing.rows);
+      }
+    }
+    return { inserted, payments: rows };
+  });
 }
 
 async function handler(req, res) {
   try {
-    if (req.method === 'GET') {
-      // Get all payments
-      const result = await query('SELECT * FROM payments ORDER BY loan_id, week');
-      res.status(200).json(result.rows);
+    if (req.path === '/bulk' && (req.method === 'POST' || req.method === 'DELETE')) {
+      let items;
+      try {
+        items = parseBulkBody(req.body, req.method === 'POST' ? 'payments' : 'ids');
+      } catch (error) {
+        return res.status(400).json({ error: 'Invalid NDJSON body' });
+      }
+      if (!items) {
+        const expected = req.method === 'POST' ? 'payments' : 'payment ids';
+        return res.status(400).json({ error: `Array of ${expected} required` });
+      }
+
+      if (req.method === 'POST') {
+        const invalid = items.some(p => !p || !Number.isInteger(p.loan_id) || !Number.isInteger(p.week) || p.week < 1 || p.amount == null);
+        if (invalid) {
+          return res.status(400).json({ error: 'Each payment needs integer loan_id, a week from 1 and an amount' });
+        }
+        try {
+          res.status(200).json(await bulkInsert(items));
+        } catch (error) {
+          // Foreign key violation: a payment refers to a missing loan
+          if (error.code === '23503') {
+            return res.status(404).json({ error: 'Loan not found' });
+          }
+          // A week past the end of its loan; nothing was written
+          if (error.status === 400) {
+            return res.status(400).json({ error: error.message });
+          }
+          throw error;
+        }
+      } else {
+        const ids = items.map(item => (typeof item === 'object' && item !== null ? item.id : item));
+        if (!ids.every(Number.isInteger)) {
+          return res.status(400).json({ error: 'Array of payment ids required' });
+        }
+        const result = await query('DELETE FROM payments WHERE id = ANY($1::int[]) RETURNING id', [ids]);
+        res.status(200).json({ deleted: result.rows.length, ids: result.rows.map(row => row.id) });
+      }
+
+    } else if (req.method === 'GET') {
+      // Unpaged lists keep the loan/week order; after_id/limit page by id
+      const { after_id, limit, loan_id, q, date_from, date_to, fields, since_version } = req.query;
+
+      // Single loan lookups (edit popups) use the prepared statement
+      if (loan_id && /^\d+$/.test(loan_id) && Object.keys(req.query).length === 1) {
+        return sendCached(req, res, req.originalUrl, async () => ({
+          data: (await prepared('paymentsByLoan', [parseInt(loan_id)])).rows
+        }));
+      }
+
+      const columns = selectColumns(fields, PAYMENT_FIELDS);
+      if (!columns) {
+        return res.status(400).json({ error: 'Unknown field requested' });
+      }
+
+      // Delta mode: only payments written, and ids deleted, since the client's version
+      if (since_version !== undefined) {
+        const sinceVersion = Number(since_version);
+        if (!Number.isInteger(sinceVersion) || sinceVersion < 0) {
+          return res.status(400).json({ error: 'since_version must be a non-negative integer' });
+        }
+        return sendCached(req, res, req.originalUrl, async () => ({
+          data: await changesSince('payments', sinceVersion, columns)
+        }));
+      }
+
+      const conditions = [];
+      const params = [];
+      if (after_id) {
+        const afterId = parseId(after_id);
+        if (afterId === null) {
+          return res.status(400).json({ error: 'after_id must be an integer' });
+        }
+        params.push(afterId);
+        conditions.push(`id > $${params.length}`);
+      }
+      if (loan_id) {
+        const loanIds = parseIds(loan_id);
+        if (!loanIds) {
+          return res.status(400).json({ error: 'loan_id must be comma separated integers' });
+        }
+        params.push(loanIds);
+        conditions.push(`loan_id = ANY($${params.length}::int[])`);
+      }
+      if (q) {
+        // Payments of the loans the same ?q= finds in /api/loans
+        params.push(`%${q.trim()}%`);
+        conditions.push(`loan_id IN (SELECT l.id FROM loans l WHERE ${loanSearchCondition(`$${params.length}`, 'l')})`);
+      }
+      if (date_from) {
+        params.push(date_from);
+        conditions.push(`date >= $${params.length}`);
+      }
+      if (date_to) {
+        params.push(date_to);
+        conditions.push(`date <= $${params.length}`);
+      }
+
+      let sql = `SELECT ${columns} FROM payments`;
+      if (conditions.length > 0) sql += ` WHERE ${conditions.join(' AND ')}`;
+      const pageSize = limit ? parseLimit(limit, MAX_LIMIT) : null;
+      if (limit && pageSize === null) {
+        return res.status(400).json({ error: `limit must be an integer from 1 to ${MAX_LIMIT}` });
+      }
+      sql += (pageSize || after_id) ? ' ORDER BY id' : ' ORDER BY loan_id, week';
+      if (pageSize) {
+        params.push(pageSize);
+        sql += ` LIMIT $${params.length}`;
+      }
+
+      await sendCached(req, res, req.originalUrl, async () => {
+        const result = await query(sql, params);
+        const headers = {};
+        if (pageSize && result.rows.length === pageSize) {
+          headers['X-Next-After-Id'] = String(result.rows[result.rows.length - 1].id);
+        }
+        return { data: result.rows, headers };
+      });
 
     } else if (req.method === 'POST') {
       // Create new payment
       const paymentData = req.body;
+      if (!paymentData || !Number.isInteger(paymentData.loan_id) || !Number.isInteger(paymentData.week)) {
+        return res.status(400).json({ error: 'Payment needs integer loan_id and week' });
+      }
+      const loan = (await prepared('loanById', [paymentData.loan_id])).rows[0];
+      if (!loan) {
+        return res.status(404).json({ error: 'Loan not found' });
+      }
+      if (paymentData.week < 1 || paymentData.week > loan.weeks) {
+        return res.status(400).json({ error: `Week must be between 1 and ${loan.weeks}` });
+      }
 
-      // Check if payment already exists for this loan_id and week
-      const existingResult = await query(
-        'SELECT * FROM payments WHERE loan_id = $1 AND week = $2',
-        [paymentData.loan_id, paymentData.week]
+      // Insert unless the week is already paid. Concurrent requests for the
+      // same week both get past a separate existence check, so the unique
+      // (loan_id, week) key decides and the loser returns the winner's row.
+      const result = await query(
+        `INSERT INTO payments (loan_id, week, amount, date) VALUES ($1, $2, $3, $4)
+         ON CONFLICT (loan_id, week) DO NOTHING RETURNING *`,
+        [paymentData.loan_id, paymentData.week, paymentData.amount, paymentData.date || new Date().toISOString().split('T')[0]]
       );
 
-      if (existingResult.rows.length > 0) {
+      if (result.rows.length > 0) {
+        res.status(200).json(result.rows[0]);
+      } else {
         // Return the existing payment data
+        const existingResult = await prepared('paymentByLoanWeek', [paymentData.loan_id, paymentData.week]);
         res.status(200).json(existingResult.rows);
-      } else {
-        // Create new payment
-        const result = await query(
-          'INSERT INTO payments (loan_id, week, amount, date) VALUES ($1, $2, $3, $4) RETURNING *',
-          [paymentData.loan_id, paymentData.week, paymentData.amount, paymentData.date || new Date().toISOString().split('T')[0]]
-        );
-
-        res.status(200).json(result.rows[0]);
       }
 
     } else if (req.method === 'PUT') {
@@ -0,0 +1,62 @@
+const { query } = require('./db');
+const { sendCached } = require('./cache');
+
+// Views in database/init.sql, shared with pgstore.py. Both read loan_balances
+// (kept current by triggers on payments), never the payments table itself.
+const PORTFOLIO_SQL = 'SELECT * FROM portfolio_totals';
+const TOP_BORROWERS_SQL = 'SELECT * FROM loan_totals ORDER BY total_amount DESC LIMIT $1';
+
+function round2(value) {
+  return Math.round(parseFloat(value) * 100) / 100;
+}
+
+async function handler(req, res) {
+  try {
+    if (req.method === 'GET') {
+      const top = Math.min(parseInt(req.query.top) || 10, 100);
+
+      await sendCached(req, res, req.originalUrl, async () => {
+        const [portfolioResult, topResult] = await Promise.all([
+          query(PORTFOLIO_SQL),
+          query(TOP_BORROWERS_SQL, [top])
+        ]);
+
+        const totals = portfolioResult.rows[0];
+        const portfolio = {
+          loans: totals.loans,
+          completed_loans: totals.completed_loans,
+          total_principal: round2(totals.total_principal),
+          total_interest: round2(totals.total_interest),
+          principal_received: round2(totals.principal_received),
+          interest_received: round2(totals.interest_received),
+          amount_collected: round2(totals.amount_collected),
+          paid_installments: totals.paid_installments,
+          scheduled_installments: totals.scheduled_installments,
+          principal_outstanding: round2(totals.total_principal - totals.principal_received),
+          interest_outstanding: round2(totals.total_interest - totals.interest_received),
+          unpaid_installments: totals.scheduled_installments - totals.paid_installments
+        };
+
+        const topBorrowers = topResult.rows.map(loan => ({
+          ...loan,
+          total_amount: round2(loan.total_amount),
+          amount_collected: round2(loan.amount_collected),
+          paid_amount: round2(loan.paid_amount),
+          outstanding_amount: round2(loan.total_amount - loan.paid_amount),
+          is_completed: loan.paid_weeks >= loan.weeks
+        }));
+
+        return { data: { portfolio, top_borrowers: topBorrowers } };
+      });
+
+    } else {
+      res.status(405).json({ error: 'Method not allowed' });
+    }
+
+  } catch (error) {
+    console.error('Summary API Error:', error);
+    res.status(500).json({ error: error.message });
+  }
+}
+
+module.exports = { handler };
@@ -0,0 +1,71 @@
+"""Per-request latency of the main.py handlers at different book sizes.
+
+Usage: python bench/store_bench.py [sizes...]   (default: 10000 100000 1000000)
+
+Seeds the in-memory store with N payments spread over N/20 loans, then
+times the handlers the pages hit on every write: add a payment, re-post
+an already paid week, delete a payment and delete a whole loan.
+"""
+import asyncio
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import main  # noqa: E402
+from store import LoanStore  # noqa: E402
+
+WEEKS = 20
+SAMPLES = 200
+
+
+def seed(n_payments):
+    main.store = LoanStore()
+    n_loans = max(1, n_payments // WEEKS)
+    for i in range(n_loans):
+        main.store.add_loan({
+            "borrower_id": f"B{i % 5000:04d}",
+            "borrower": f"Borrower {i % 5000}",
+            "amount": 10000.0,
+            "interest": 20.0,
+            "weeks": WEEKS,
+            "start_date": date(2025, 1, 6),
+        })
+    for loan_id in range(1, n_loans + 1):
+        for week in range(1, WEEKS + 1):
+            main.store.add_payment({"loan_id": loan_id, "week": week, "amount": 600.0,
+                                    "date": date(2025, 1, 6 + week)})
+    return n_loans
+
+
+async def timed(fn, args_list):
+    start = time.perf_counter()
+    for args in args_list:
+        await fn(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1e6
+
+
+async def run(n_payments):
+    n_loans = seed(n_payments)
+    loan = main.Loan(borrower_id="BNEW", borrower="New", amount=1000, interest=10,
+                     weeks=SAMPLES, start_date=date(2025, 1, 6))
+    new_loan_id = (await main.add_loan(loan))["id"]
+
+    add = await timed(main.add_payment,
+                      [(main.Payment(loan_id=new_loan_id, week=w, amount=55),) for w in range(1, SAMPLES + 1)])
+    dup = await timed(main.add_payment,
+                      [(main.Payment(loan_id=new_loan_id, week=w, amount=55),) for w in range(1, SAMPLES + 1)])
+    ids = [p["id"] for p in main.store.payments_for_loan(new_loan_id)]
+    delete = await timed(main.delete_payment, [(pid,) for pid in ids])
+    cascade = await timed(main.delete_loan, [(loan_id,) for loan_id in range(1, min(n_loans, SAMPLES) + 1)])
+
+    print(f"{n_payments:>9,} payments | add {add:7.1f} us | duplicate {dup:7.1f} us"
+          f" | delete payment {delete:7.1f} us | delete loan {cascade:7.1f} us")
+
+
+if __name__ == "__main__":
+    sizes = [int(s) for s in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for size in sizes:
+        asyncio.run(run(size))
@@ -0,0 +1,96 @@
+"""Write throughput and restart time of the durable store (walstore.py).
+
+Usage: python bench/wal_bench.py [payments]   (default: 1000000)
+
+Appends payments from 1, 8, 64 and 512 concurrent writers, each waiting for
+its write to be fsynced (group commit), then snapshots a book of N payments,
+adds 10k more to the log and times how long a fresh store takes to open it
+(snapshot load plus log replay).
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from walstore import WalStore  # noqa: E402
+
+WEEKS = 20
+WRITES = 20_000
+TAIL = 10_000
+WRITERS = [1, 8, 64, 512]
+
+
+def add_loans(store, n_loans):
+    for i in range(n_loans):
+        store.add_loan({
+            "borrower_id": f"B{i % 5000:04d}",
+            "borrower": f"Borrower {i % 5000}",
+            "amount": 10000.0,
+            "interest": 20.0,
+            "weeks": WEEKS,
+            "start_date": date(2025, 1, 6),
+        })
+
+
+def add_payments(store, first_loan, n_payments):
+    for n in range(n_payments):
+        loan_id = first_loan + n // WEEKS
+        store.add_payment({"loan_id": loan_id, "week": n % WEEKS + 1, "amount": 600.0,
+                           "date": date(2025, 1, 7 + n % WEEKS)})
+
+
+async def write_concurrently(store, writers):
+    async def writer(first):
+        for n in range(first, WRITES, writers):
+            store.add_payment({"loan_id": 1 + n // WEEKS, "week": n % WEEKS + 1, "amount": 600.0,
+                               "date": date(2025, 1, 7 + n % WEEKS)})
+            await store.commit()
+
+    await asyncio.gather(*(writer(first) for first in range(writers)))
+
+
+def write_throughput(writers):
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = WalStore(data_dir).open()
+        add_loans(store, WRITES // WEEKS)
+        store.sync()
+        start = time.perf_counter()
+        asyncio.run(write_concurrently(store, writers))
+        elapsed = time.perf_counter() - start
+        store.close()
+    print(f"{writers:>4} writers | {WRITES / elapsed:>9,.0f} durable payments/s"
+          f" | {elapsed / WRITES * 1e6:7.1f} us per write")
+
+
+def restart(n_payments):
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = WalStore(data_dir).open()
+        n_loans = n_payments // WEEKS
+        add_loans(store, n_loans + TAIL // WEEKS)
+        add_payments(store, 1, n_payments)
+        start = time.perf_counter()
+        store.snapshot()
+        snapshot = time.perf_counter() - start
+        add_payments(store, n_loans + 1, TAIL)
+        store.close()
+        size = os.path.getsize(store.snapshot_path) / 1e6
+        del store
+
+        start = time.perf_counter()
+        reopened = WalStore(data_dir).open()
+        opened = time.perf_counter() - start
+        assert len(reopened.payments) == n_payments + TAIL
+        reopened.close()
+    print(f"{n_payments:>9,} payments | snapshot {snapshot:5.2f} s ({size:.0f} MB)"
+          f" | open with {TAIL:,} logged writes {opened:5.2f} s")
+
+
+if __name__ == "__main__":
+    n_payments = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    for writers in WRITERS:
+        write_throughput(writers)
+    restart(n_payments)
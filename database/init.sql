@@ -1,5 +1,8 @@
 -- Initialize the database schema for the loan management system
 
+-- Trigram matching for loan search (borrower id, name and loan id contain '%term%')
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Create users table for authentication
 CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
@@ -29,8 +32,9 @@ CREATE TABLE IF NOT EXISTS loans (
     borrower VARCHAR(255) NOT NULL,
     amount DECIMAL(12, 2) NOT NULL,
     interest DECIMAL(5, 2) NOT NULL,
-    weeks INTEGER NOT NULL,
+    weeks INTEGER NOT NULL CHECK (weeks > 0), -- installments divide by it
     start_date DATE NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0, -- data_version of the last write
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -42,18 +46,63 @@ CREATE TABLE IF NOT EXISTS payments (
     week INTEGER NOT NULL,
     amount DECIMAL(10, 2) NOT NULL,
     date DATE NOT NULL DEFAULT CURRENT_DATE,
+    version BIGINT NOT NULL DEFAULT 0, -- data_version of the last write
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(loan_id, week)
 );
 
+-- Create per-loan balances, maintained by triggers on loans and payments
+CREATE TABLE IF NOT EXISTS loan_balances (
+    loan_id INTEGER PRIMARY KEY REFERENCES loans(id) ON DELETE CASCADE,
+    paid_weeks INTEGER NOT NULL DEFAULT 0,
+    amount_collected DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create the data version, bumped once by every transaction that writes
+-- loans or payments, so API caches and ?since_version= clients can tell
+-- what changed
+CREATE TABLE IF NOT EXISTS data_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0,
+    deleted_horizon BIGINT NOT NULL DEFAULT 0 -- tombstones up to this version were pruned
+);
+
+INSERT INTO data_version (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+
+-- Create tombstones for deleted loans and payments (?since_version= deltas)
+CREATE TABLE IF NOT EXISTS deleted_rows (
+    table_name VARCHAR(20) NOT NULL,
+    row_id INTEGER NOT NULL,
+    version BIGINT NOT NULL,
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Add the version columns to databases created before them, so the version
+-- triggers and indexes below work on an existing book too (rows written
+-- before start at version 0)
+ALTER TABLE loans ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE data_version ADD COLUMN IF NOT EXISTS deleted_horizon BIGINT NOT NULL DEFAULT 0;
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
 CREATE INDEX IF NOT EXISTS idx_users_role ON users(role);
 CREATE INDEX IF NOT EXISTS idx_loans_borrower_id ON loans(borrower_id);
+CREATE INDEX IF NOT EXISTS idx_loans_start_date ON loans(start_date);
+CREATE INDEX IF NOT EXISTS idx_loans_borrower_trgm ON loans USING gin (borrower gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_loans_borrower_id_trgm ON loans USING gin (borrower_id gin_trgm_ops);
+-- Loan id search (id::text LIKE '%term%'), so the OR of all three is a bitmap OR of index scans
+CREATE INDEX IF NOT EXISTS idx_loans_id_text_trgm ON loans USING gin ((id::text) gin_trgm_ops);
 CREATE INDEX IF NOT EXISTS idx_payments_loan_id ON payments(loan_id);
 CREATE INDEX IF NOT EXISTS idx_payments_week ON payments(week);
 CREATE INDEX IF NOT EXISTS idx_payments_date ON payments(date);
+CREATE INDEX IF NOT EXISTS idx_loans_total_amount ON loans((amount * (1 + interest / 100)) DESC);
+CREATE INDEX IF NOT EXISTS idx_loans_version ON loans(version);
+CREATE INDEX IF NOT EXISTS idx_payments_version ON payments(version);
+CREATE INDEX IF NOT EXISTS idx_deleted_rows_version ON deleted_rows(table_name, version);
+CREATE INDEX IF NOT EXISTS idx_deleted_rows_deleted_at ON deleted_rows(deleted_at);
 
 -- Create function to update updated_at timestamp
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -74,6 +123,244 @@ CREATE TRIGGER update_loans_updated_at BEFORE UPDATE ON loans
 CREATE TRIGGER update_payments_updated_at BEFORE UPDATE ON payments
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Create a zero balance row for every new loan
+CREATE OR REPLACE FUNCTION init_loan_balance()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO loan_balances (loan_id) VALUES (NEW.id) ON CONFLICT (loan_id) DO NOTHING;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+-- Keep loan_balances in step with payment inserts, updates and deletes
+CREATE OR REPLACE FUNCTION apply_payment_to_balance()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE loan_balances
+        SET paid_weeks = paid_weeks - 1,
+            amount_collected = amount_collected - OLD.amount,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE loan_id = OLD.loan_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO loan_balances (loan_id, paid_weeks, amount_collected)
+        VALUES (NEW.loan_id, 1, NEW.amount)
+        ON CONFLICT (loan_id) DO UPDATE
+        SET paid_weeks = loan_balances.paid_weeks + 1,
+            amount_collected = loan_balances.amount_collected + EXCLUDED.amount_collected,
+            updated_at = CURRENT_TIMESTAMP;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER init_loans_balance AFTER INSERT ON loans
+    FOR EACH ROW EXECUTE FUNCTION init_loan_balance();
+
+CREATE TRIGGER apply_payments_balance AFTER INSERT OR UPDATE OR DELETE ON payments
+    FOR EACH ROW EXECUTE FUNCTION apply_payment_to_balance();
+
+-- Version of the current transaction's writes: one past data_version, read
+-- under its row lock, which is kept until commit so versions are handed out
+-- in commit order. Later writes in the same transaction reuse it.
+CREATE OR REPLACE FUNCTION current_write_version()
+RETURNS BIGINT AS $$
+DECLARE
+    write_version TEXT := current_setting('loan_app.write_version', true);
+BEGIN
+    IF write_version IS NULL OR write_version = '' THEN
+        SELECT (version + 1)::text INTO write_version FROM data_version FOR UPDATE;
+        PERFORM set_config('loan_app.write_version', write_version, true);
+    END IF;
+    RETURN write_version::bigint;
+END;
+$$ language 'plpgsql';
+
+-- Bump data_version to the transaction's write version, once. This runs from
+-- AFTER row triggers, which only fire for rows actually written: an
+-- INSERT ... ON CONFLICT DO NOTHING that skips every row leaves the version
+-- (and every cached response) alone.
+CREATE OR REPLACE FUNCTION publish_write_version()
+RETURNS TRIGGER AS $$
+DECLARE
+    write_version BIGINT := current_write_version();
+BEGIN
+    IF current_setting('loan_app.published_version', true) IS DISTINCT FROM write_version::text THEN
+        UPDATE data_version SET version = write_version;
+        PERFORM set_config('loan_app.published_version', write_version::text, true);
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION stamp_row_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.version = current_write_version();
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION record_deleted_row()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO deleted_rows (table_name, row_id, version)
+    VALUES (TG_TABLE_NAME, OLD.id, current_write_version());
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER stamp_loans_version BEFORE INSERT OR UPDATE ON loans
+    FOR EACH ROW EXECUTE FUNCTION stamp_row_version();
+
+CREATE TRIGGER stamp_payments_version BEFORE INSERT OR UPDATE ON payments
+    FOR EACH ROW EXECUTE FUNCTION stamp_row_version();
+
+CREATE TRIGGER record_loans_delete AFTER DELETE ON loans
+    FOR EACH ROW EXECUTE FUNCTION record_deleted_row();
+
+CREATE TRIGGER record_payments_delete AFTER DELETE ON payments
+    FOR EACH ROW EXECUTE FUNCTION record_deleted_row();
+
+CREATE TRIGGER publish_loans_version AFTER INSERT OR UPDATE OR DELETE ON loans
+    FOR EACH ROW EXECUTE FUNCTION publish_write_version();
+
+CREATE TRIGGER publish_payments_version AFTER INSERT OR UPDATE OR DELETE ON payments
+    FOR EACH ROW EXECUTE FUNCTION publish_write_version();
+
+-- Drop tombstones older than keep and raise deleted_horizon past them, so
+-- ?since_version= clients older than the horizon reload in full instead of
+-- missing deletions. Runs once per DELETE statement on loans or payments; the
+-- deleted_at index makes it a single probe when there is nothing to drop.
+CREATE OR REPLACE FUNCTION prune_deleted_rows(keep INTERVAL DEFAULT '30 days')
+RETURNS BIGINT AS $$
+    WITH pruned AS (
+        DELETE FROM deleted_rows WHERE deleted_at < CURRENT_TIMESTAMP - keep RETURNING version
+    )
+    UPDATE data_version SET deleted_horizon = GREATEST(deleted_horizon, (SELECT max(version) FROM pruned))
+    WHERE EXISTS (SELECT 1 FROM pruned)
+    RETURNING deleted_horizon;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION prune_deleted_rows_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM prune_deleted_rows();
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER prune_loans_tombstones AFTER DELETE ON loans
+    FOR EACH STATEMENT EXECUTE FUNCTION prune_deleted_rows_trigger();
+
+CREATE TRIGGER prune_payments_tombstones AFTER DELETE ON payments
+    FOR EACH STATEMENT EXECUTE FUNCTION prune_deleted_rows_trigger();
+
+-- Queries shared by the Express API (api/*-local.js) and the FastAPI
+-- Postgres backend (pgstore.py), so both services compute the same figures
+
+-- Unpaid installments due by a date, sorted by due date, one page of them
+-- with the count and amount of all of them. Week N of a loan falls due on
+-- start_date + 7 * N days; the schedule is expanded with generate_series
+-- only up to the date and anti-joined against payments(loan_id, week).
+-- search matches borrower id, name or loan id; both filters are optional.
+CREATE OR REPLACE FUNCTION due_installments(until DATE, search TEXT, only_borrower TEXT,
+                                            page_limit INTEGER, page_offset INTEGER)
+RETURNS TABLE (loan_id INTEGER, borrower_id VARCHAR, borrower VARCHAR, amount DECIMAL,
+               installment DECIMAL, week INTEGER, due_date DATE, total_count BIGINT, total_amount DECIMAL)
+AS $$
+    SELECT l.id, l.borrower_id, l.borrower, l.amount,
+           ROUND(l.amount * (1 + l.interest / 100) / l.weeks, 2),
+           w.week, l.start_date + 7 * w.week,
+           COUNT(*) OVER (),
+           SUM(ROUND(l.amount * (1 + l.interest / 100) / l.weeks, 2)) OVER ()
+    FROM loans l
+    CROSS JOIN LATERAL generate_series(1, LEAST(l.weeks, (until - l.start_date) / 7)) AS w(week)
+    LEFT JOIN payments p ON p.loan_id = l.id AND p.week = w.week
+    WHERE p.id IS NULL
+      AND (search IS NULL OR l.borrower_id ILIKE '%' || search || '%' OR l.borrower ILIKE '%' || search || '%'
+           OR l.id::text LIKE '%' || search || '%')
+      AND (only_borrower IS NULL OR l.borrower_id = only_borrower)
+    ORDER BY l.start_date + 7 * w.week, l.id
+    LIMIT page_limit OFFSET page_offset
+$$ LANGUAGE sql STABLE;
+
+-- Portfolio totals from loan_balances, never the payments table. Received
+-- amounts are prorated by paid weeks, as the dashboard pages compute them.
+CREATE OR REPLACE VIEW portfolio_totals AS
+SELECT COUNT(*)::int AS loans,
+       COUNT(*) FILTER (WHERE COALESCE(b.paid_weeks, 0) >= l.weeks)::int AS completed_loans,
+       COALESCE(SUM(l.amount), 0) AS total_principal,
+       COALESCE(SUM(l.amount * l.interest / 100), 0) AS total_interest,
+       COALESCE(SUM(l.amount * COALESCE(b.paid_weeks, 0) / l.weeks), 0) AS principal_received,
+       COALESCE(SUM(l.amount * l.interest / 100 * COALESCE(b.paid_weeks, 0) / l.weeks), 0) AS interest_received,
+       COALESCE(SUM(b.amount_collected), 0) AS amount_collected,
+       COALESCE(SUM(b.paid_weeks), 0)::int AS paid_installments,
+       COALESCE(SUM(l.weeks), 0)::int AS scheduled_installments
+FROM loans l
+LEFT JOIN loan_balances b ON b.loan_id = l.id;
+
+-- Every loan with its total due and what has been paid toward it; ordering
+-- by total_amount is served by idx_loans_total_amount
+CREATE OR REPLACE VIEW loan_totals AS
+SELECT l.*,
+       l.amount * (1 + l.interest / 100) AS total_amount,
+       COALESCE(b.paid_weeks, 0) AS paid_weeks,
+       COALESCE(b.amount_collected, 0) AS amount_collected,
+       l.amount * (1 + l.interest / 100) * COALESCE(b.paid_weeks, 0) / l.weeks AS paid_amount
+FROM loans l
+LEFT JOIN loan_balances b ON b.loan_id = l.id;
+
+-- Export rows, one per loan as the dashboard table shows it. Dates are
+-- YYYY-MM-DD text, as they appear in the CSV and NDJSON files.
+CREATE OR REPLACE VIEW loan_export AS
+SELECT l.id AS loan_id, l.borrower_id, l.borrower, l.amount,
+       to_char(l.start_date, 'YYYY-MM-DD') AS start_date, l.interest, l.weeks,
+       paid.weeks AS paid_weeks,
+       l.weeks - paid.weeks AS remaining_weeks,
+       ROUND(i.installment * paid.weeks, 2) AS total_paid,
+       ROUND(i.installment * (l.weeks - paid.weeks), 2) AS remaining_amount,
+       i.installment,
+       CASE WHEN paid.weeks < l.weeks
+            THEN to_char(l.start_date + 7 * (paid.weeks + 1), 'YYYY-MM-DD') END AS next_due_date,
+       CASE WHEN paid.weeks >= l.weeks THEN 'Completed' ELSE 'In Progress' END AS status
+FROM loans l
+LEFT JOIN loan_balances b ON b.loan_id = l.id
+CROSS JOIN LATERAL (SELECT COALESCE(b.paid_weeks, 0) AS weeks) paid
+CROSS JOIN LATERAL (SELECT ROUND(l.amount * (1 + l.interest / 100) / l.weeks, 2) AS installment) i;
+
+-- Export rows, one per scheduled week with its payment; weeks due by as_of
+-- and unpaid are 'due'
+CREATE OR REPLACE FUNCTION installment_export(as_of DATE)
+RETURNS TABLE (loan_id INTEGER, borrower_id VARCHAR, borrower VARCHAR, amount DECIMAL, interest DECIMAL,
+               weeks INTEGER, start_date TEXT, week INTEGER, due_date TEXT, installment DECIMAL,
+               status TEXT, paid_amount DECIMAL, paid_date TEXT)
+AS $$
+    SELECT l.id, l.borrower_id, l.borrower, l.amount, l.interest, l.weeks,
+           to_char(l.start_date, 'YYYY-MM-DD'), w.week,
+           to_char(l.start_date + 7 * w.week, 'YYYY-MM-DD'),
+           ROUND(l.amount * (1 + l.interest / 100) / l.weeks, 2),
+           CASE WHEN p.id IS NOT NULL THEN 'paid'
+                WHEN l.start_date + 7 * w.week <= as_of THEN 'due'
+                ELSE 'upcoming' END,
+           p.amount, to_char(p.date, 'YYYY-MM-DD')
+    FROM loans l
+    CROSS JOIN LATERAL generate_series(1, l.weeks) AS w(week)
+    LEFT JOIN payments p ON p.loan_id = l.id AND p.week = w.week
+    ORDER BY l.id, w.week
+$$ LANGUAGE sql STABLE;
+
+-- Backfill balances for loans that existed before the triggers
+INSERT INTO loan_balances (loan_id, paid_weeks, amount_collected)
+SELECT l.id, COUNT(p.id), COALESCE(SUM(p.amount), 0)
+FROM loans l
+LEFT JOIN payments p ON p.loan_id = l.id
+GROUP BY l.id
+ON CONFLICT (loan_id) DO NOTHING;
+
 -- Grant permissions
 GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA public TO loan_user;
 GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA public TO loan_user;
\ No newline at end of file
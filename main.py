@@ -0,0 +1,437 @@
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+import asyncio
+import csv
+import datetime
+import hashlib
+import inspect
+import io
+import json
+import logging
+import os
+import zlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Literal, Optional
+
+import metrics
+from pgstore import PgStore
+from store import LoanStore
+from walstore import WalStore
+
+logger = logging.getLogger(__name__)
+
+# Postgres (shared with the Express API) when DATABASE_URL is set,
+# otherwise in-memory storage indexed by id and by (loan_id, week),
+# made durable with a write-ahead log and snapshots when DATA_DIR is set
+DATABASE_URL = os.environ.get("DATABASE_URL")
+DATA_DIR = os.environ.get("DATA_DIR")
+WAL_CHECKPOINT_INTERVAL_MS = int(os.environ.get("WAL_CHECKPOINT_INTERVAL_MS", 1000))
+if DATABASE_URL:
+    store = PgStore(DATABASE_URL)
+elif DATA_DIR:
+    store = WalStore(DATA_DIR, snapshot_every=int(os.environ.get("WAL_SNAPSHOT_EVERY", 100_000)))
+else:
+    store = LoanStore()
+
+
+async def maintain_wal():
+    """Checkpoint in the background once enough of the log has piled up."""
+    while True:
+        await asyncio.sleep(WAL_CHECKPOINT_INTERVAL_MS / 1000)
+        if store.records_since_snapshot >= store.snapshot_every:
+            try:
+                await store.checkpoint()
+            except OSError as error:
+                # The log still has everything; the next round tries again
+                logger.error("WAL checkpoint failed: %s", error)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if isinstance(store, PgStore):
+        await store.open()
+    if isinstance(store, WalStore):
+        store.open()
+        maintenance = asyncio.create_task(maintain_wal())
+    yield
+    if isinstance(store, PgStore):
+        await store.close()
+    if isinstance(store, WalStore):
+        maintenance.cancel()
+        await store.shutdown()
+
+app = FastAPI(title="Loan App (Weekly Installments)", lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Next-After-Id", "ETag", "X-Data-Version"],
+)
+# Outermost, so CORS handling is timed too
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+# ----------------------------
+# Models
+# ----------------------------
+class Loan(BaseModel):
+    borrower_id: str = Field(max_length=50)  # VARCHAR(50) and VARCHAR(255) in database/init.sql
+    borrower: str = Field(max_length=255)
+    amount: float
+    interest: float
+    weeks: int = Field(gt=0)
+    start_date: date
+
+class Payment(BaseModel):
+    loan_id: int
+    week: int = Field(ge=1)  # and at most the loan's weeks, checked against the loan
+    amount: float
+    date: Optional[datetime.date] = None
+
+
+LOAN_FIELDS = {"id", "borrower_id", "borrower", "amount", "interest", "weeks", "start_date", "version"}
+PAYMENT_FIELDS = {"id", "loan_id", "week", "amount", "date", "version"}
+
+
+# ----------------------------
+# List helpers
+# ----------------------------
+def parse_ids(value):
+    """Parse a comma separated id list such as ``ids=1,2,3``."""
+    try:
+        return [int(part) for part in value.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ids must be comma separated integers")
+
+def project(rows, fields, allowed):
+    """Keep only the requested ``fields`` (``id`` is always kept)."""
+    if fields is None:
+        return rows
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = set(names) - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    if "id" not in names:
+        names.insert(0, "id")
+    return [{name: row[name] for name in names} for row in rows]
+
+async def resolve(result):
+    """LoanStore answers directly, PgStore with a coroutine."""
+    return await result if inspect.isawaitable(result) else result
+
+
+async def written(result):
+    """resolve() for writes: with WalStore, wait until the write is fsynced."""
+    result = await resolve(result)
+    if isinstance(store, WalStore):
+        await store.commit()
+    return result
+
+async def read_bulk_body(request, key, items_name=None):
+    """Bulk bodies are a JSON array, ``{key: [...]}`` or NDJSON (one item per line).
+    ``items_name`` names the items in the error for any other body."""
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if isinstance(items, dict):
+        items = items.get(key)
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail=f"Array of {items_name or key} required")
+    return items
+
+def paginate(headers, rows, limit):
+    """Advertise the keyset cursor for the next page when this one is full."""
+    if limit is not None and len(rows) == limit:
+        headers["X-Next-After-Id"] = str(rows[-1]["id"])
+    return rows
+
+async def changes(table, since_version, fields, allowed):
+    """``?since_version=`` delta: rows written and ids deleted since then, or
+    every row (``full``) when the store no longer knows that history."""
+    result = await resolve(store.changes_since(table, since_version))
+    if result is None:
+        version = await resolve(store.data_version())
+        rows = await resolve(store.query_loans() if table == "loans" else store.query_payments())
+        return {"version": version, "full": True, "rows": project(rows, fields, allowed), "deleted": []}
+    version, rows, deleted = result
+    return {"version": version, "full": False, "rows": project(rows, fields, allowed), "deleted": deleted}
+
+
+# ----------------------------
+# Response cache
+# ----------------------------
+# Serialized GET bodies keyed by URL, reused while the data version is
+# unchanged; every loan/payment write bumps it. Least recently used first.
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 500))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+response_cache = OrderedDict()  # key -> (version, etag, body, headers)
+cache_counters = {"bytes": 0, "hits": 0, "misses": 0, "not_modified": 0}
+
+def cache_put(key, entry):
+    old = response_cache.pop(key, None)
+    if old is not None:
+        cache_counters["bytes"] -= len(old[2])
+    if len(entry[2]) > CACHE_MAX_BYTES:
+        return
+    response_cache[key] = entry
+    cache_counters["bytes"] += len(entry[2])
+    while len(response_cache) > CACHE_MAX_ENTRIES or cache_counters["bytes"] > CACHE_MAX_BYTES:
+        _, evicted = response_cache.popitem(last=False)
+        cache_counters["bytes"] -= len(evicted[2])
+
+async def cached(request, build):
+    """Respond with ``await build(headers)`` as JSON, from the cache while the
+    data version is unchanged. The ETag hashes the body, so a client whose
+    copy is still identical gets a bodiless 304 even after unrelated writes."""
+    version = await resolve(store.data_version())
+    key = f"{request.url.path}?{request.url.query}"
+    entry = response_cache.get(key)
+    if entry is not None and entry[0] == version:
+        response_cache.move_to_end(key)
+        cache_counters["hits"] += 1
+    else:
+        cache_counters["misses"] += 1
+        headers = {}
+        content = await build(headers)
+        body = json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode()
+        entry = (version, f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"', body, headers)
+        cache_put(key, entry)
+
+    version, etag, body, headers = entry
+    headers = {**headers, "ETag": etag, "X-Data-Version": str(version), "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        cache_counters["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+# ----------------------------
+# Loans
+# ----------------------------
+@app.get("/loans")
+async def get_loans(request: Request, after_id: Optional[int] = None,
+              limit: Optional[int] = Query(None, ge=1, le=1000),
+              borrower_id: Optional[str] = None, q: Optional[str] = None,
+              start_from: Optional[date] = None, start_to: Optional[date] = None,
+              ids: Optional[str] = None, fields: Optional[str] = None,
+              since_version: Optional[int] = Query(None, ge=0)):
+    async def build(headers):
+        if since_version is not None:
+            return await changes("loans", since_version, fields, LOAN_FIELDS)
+        rows = await resolve(store.query_loans(after_id=after_id, limit=limit, borrower_id=borrower_id, q=q,
+                                               start_from=start_from, start_to=start_to,
+                                               ids=parse_ids(ids) if ids else None))
+        return project(paginate(headers, rows, limit), fields, LOAN_FIELDS)
+    return await cached(request, build)
+
+@app.post("/loans")
+async def add_loan(loan: Loan):
+    return await written(store.add_loan(loan.dict()))
+
+@app.delete("/loans/{loan_id}")
+async def delete_loan(loan_id: int):
+    if await written(store.delete_loan(loan_id)) is None:
+        raise HTTPException(status_code=404, detail="Loan not found")
+    return {"detail": f"Loan {loan_id} deleted"}
+
+
+# ----------------------------
+# Payments
+# ----------------------------
+@app.get("/payments")
+async def get_payments(request: Request, after_id: Optional[int] = None,
+                 limit: Optional[int] = Query(None, ge=1, le=1000),
+                 loan_id: Optional[str] = None, q: Optional[str] = None,
+                 date_from: Optional[date] = None, date_to: Optional[date] = None,
+                 fields: Optional[str] = None, since_version: Optional[int] = Query(None, ge=0)):
+    async def build(headers):
+        if since_version is not None:
+            return await changes("payments", since_version, fields, PAYMENT_FIELDS)
+        rows = await resolve(store.query_payments(after_id=after_id, limit=limit,
+                                                  loan_ids=parse_ids(loan_id) if loan_id else None, q=q,
+                                                  date_from=date_from, date_to=date_to))
+        return project(paginate(headers, rows, limit), fields, PAYMENT_FIELDS)
+    return await cached(request, build)
+
+@app.post("/payments")
+async def add_payment(payment: Payment):
+    loan = await resolve(store.get_loan(payment.loan_id))
+    if loan is None:
+        raise HTTPException(status_code=404, detail="Loan not found")
+    if payment.week > loan["weeks"]:
+        raise HTTPException(status_code=400, detail=f"Week must be between 1 and {loan['weeks']}")
+    payment_dict = payment.dict()
+    payment_dict["date"] = payment_dict["date"] or date.today()
+    payment_dict, _ = await written(store.add_payment(payment_dict))
+    return payment_dict
+
+@app.post("/payments/bulk")
+async def add_payments_bulk(request: Request):
+    items = await read_bulk_body(request, "payments")
+    try:
+        payments = [Payment(**item) for item in items]
+    except (TypeError, ValidationError):
+        raise HTTPException(status_code=400, detail="Each payment needs loan_id, week and amount")
+    today = date.today()
+    payment_dicts = [payment.dict() for payment in payments]
+    for payment_dict in payment_dicts:
+        payment_dict["date"] = payment_dict["date"] or today
+    # All or nothing: nothing is written if any loan is missing or any week
+    # is outside its loan
+    try:
+        result = await written(store.add_payments(payment_dicts))
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Loan not found")
+    inserted, rows = result
+    return {"inserted": inserted, "payments": rows}
+
+@app.delete("/payments/bulk")
+async def delete_payments_bulk(request: Request):
+    items = await read_bulk_body(request, "ids", "payment ids")
+    ids = [item.get("id") if isinstance(item, dict) else item for item in items]
+    if not all(type(payment_id) is int for payment_id in ids):  # not true/false
+        raise HTTPException(status_code=400, detail="Array of payment ids required")
+    deleted = await written(store.delete_payments(ids))
+    return {"deleted": len(deleted), "ids": deleted}
+
+@app.delete("/payments/{payment_id}")
+async def delete_payment(payment_id: int):
+    if await written(store.delete_payment(payment_id)) is None:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    return {"detail": f"Payment {payment_id} deleted"}
+
+
+# ----------------------------
+# Installments
+# ----------------------------
+@app.get("/installments/due")
+async def get_due_installments(request: Request, until: date, q: Optional[str] = None,
+                         borrower_id: Optional[str] = None,
+                         limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    async def build(headers):
+        rows, total, total_amount = await resolve(
+            store.due_installments(until, q=q, borrower_id=borrower_id, limit=limit, offset=offset))
+        return {
+            "rows": rows,
+            "total": total,
+            "total_amount": total_amount,
+            "limit": limit,
+            "offset": offset,
+        }
+    return await cached(request, build)
+
+
+# ----------------------------
+# Summary
+# ----------------------------
+@app.get("/summary")
+async def get_summary(request: Request, top: int = Query(10, ge=1, le=100)):
+    async def build(headers):
+        return await resolve(store.summary(top))
+    return await cached(request, build)
+
+
+# ----------------------------
+# Export
+# ----------------------------
+# (row key, CSV header) per view; the same files as the Express /api/export
+EXPORT_COLUMNS = {
+    "loans": [
+        ("loan_id", "Loan ID"), ("borrower_id", "Borrower ID"), ("borrower", "Borrower"), ("amount", "Amount"),
+        ("start_date", "Start Date"), ("interest", "Interest %"), ("weeks", "Weeks"), ("paid_weeks", "Paid Weeks"),
+        ("remaining_weeks", "Remaining Weeks"), ("total_paid", "Total Paid"), ("remaining_amount", "Remaining Amount"),
+        ("installment", "Weekly Installment"), ("next_due_date", "Next Due Date"), ("status", "Completion Status"),
+    ],
+    "weeks": [
+        ("loan_id", "Loan ID"), ("borrower_id", "Borrower ID"), ("borrower", "Borrower"), ("amount", "Amount"),
+        ("interest", "Interest %"), ("weeks", "Weeks"), ("start_date", "Start Date"), ("week", "Week"),
+        ("due_date", "Due Date"), ("installment", "Installment"), ("status", "Status"),
+        ("paid_amount", "Paid Amount"), ("paid_date", "Paid Date"),
+    ],
+}
+EXPORT_CHUNK_ROWS = 1000
+
+async def iterate(rows):
+    """LoanStore yields export rows directly, PgStore asynchronously."""
+    if hasattr(rows, "__aiter__"):
+        async for row in rows:
+            yield row
+    else:
+        for row in rows:
+            yield row
+
+async def export_chunks(view, fmt, compress):
+    """Encode export rows EXPORT_CHUNK_ROWS at a time, optionally gzipped,
+    so only one chunk is ever held in memory."""
+    columns = EXPORT_COLUMNS[view]
+    gzip = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip framing
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+
+    def take():
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return gzip.compress(data) if gzip else data
+
+    if fmt == "csv":
+        writer.writerow([header for _, header in columns])
+    rows = 0
+    async for row in iterate(store.export_rows(view, date.today())):
+        if fmt == "csv":
+            writer.writerow([row[key] for key, _ in columns])
+        else:
+            buffer.write(json.dumps(row, default=str) + "\n")
+        rows += 1
+        if rows % EXPORT_CHUNK_ROWS == 0:
+            chunk = take()
+            if chunk:
+                yield chunk
+    chunk = take() + (gzip.flush() if gzip else b"")
+    if chunk:
+        yield chunk
+
+@app.get("/export")
+async def export(request: Request, fmt: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+                 view: Literal["loans", "weeks"] = "loans"):
+    if isinstance(store, PgStore) and store.exports_full():
+        raise HTTPException(status_code=503, detail="Too many exports in progress, try again shortly",
+                            headers={"Retry-After": "30"})
+    compress = "gzip" in request.headers.get("accept-encoding", "")
+    headers = {
+        "Content-Disposition": f'attachment; filename="{view}_export_{date.today()}.{fmt}"',
+        "Vary": "Accept-Encoding",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    media_type = "text/csv; charset=utf-8" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(export_chunks(view, fmt, compress), media_type=media_type, headers=headers)
+
+
+# ----------------------------
+# Health
+# ----------------------------
+@app.get("/health")
+async def get_health():
+    return {"status": "OK", "timestamp": datetime.datetime.now().isoformat(), **store.stats(),
+            "response_cache": {"entries": len(response_cache), "max_entries": CACHE_MAX_ENTRIES,
+                               "max_bytes": CACHE_MAX_BYTES, **cache_counters}}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Route latency, payload sizes and database timings for Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,146 @@
+"""Request and query metrics for the FastAPI service (main.py).
+
+Counters and histograms are kept in process memory and rendered in the
+Prometheus text format on GET /metrics, without depending on
+prometheus_client. The metric names match api/metrics.js, so one
+dashboard covers both services.
+"""
+import re
+import time
+from bisect import bisect_left
+
+# Upper bounds in seconds, 1 ms to 10 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds",
+                            "Time from receiving a request to sending the last byte of its response",
+                            ("method", "route", "status"))
+REQUEST_BYTES = Counter("http_request_bytes_total", "Request body bytes received", ("method", "route"))
+RESPONSE_BYTES = Counter("http_response_bytes_total", "Response body bytes sent", ("method", "route"))
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Database statement execution time", ("statement",))
+DB_SLOW_QUERIES = Counter("db_slow_queries_total", "Statements slower than DB_SLOW_QUERY_MS", ("statement",))
+
+METRICS = (REQUEST_SECONDS, REQUEST_BYTES, RESPONSE_BYTES, DB_QUERY_SECONDS, DB_SLOW_QUERIES)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+_VERB = re.compile(r"\s*([a-z]*)", re.IGNORECASE)
+_TABLE = re.compile(r"\b(?:from|into|update)\s+([a-z_][a-z0-9_]*)", re.IGNORECASE)
+
+def statement_label(sql):
+    """A short label with bounded cardinality for a statement: its verb and
+    first table, e.g. ``select loans`` or ``insert payments``."""
+    verb = _VERB.match(sql).group(1).lower()
+    match = _TABLE.search(sql)
+    return f"{verb} {match.group(1).lower()}" if match else verb
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request until its last body chunk is sent
+    (so streamed exports are measured in full) and counting payload bytes.
+
+    Requests are labelled with the matched route template, e.g.
+    ``/payments/{payment_id}``, never the raw path.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+        received = sent = 0
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            # The router stores the matched route in the shared scope
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            REQUEST_SECONDS.observe((method, path, str(status)), time.perf_counter() - start)
+            REQUEST_BYTES.inc((method, path), received)
+            RESPONSE_BYTES.inc((method, path), sent)
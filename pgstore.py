@@ -0,0 +1,349 @@
+"""Postgres backend for the FastAPI service (main.py).
+
+Used instead of the in-memory LoanStore when DATABASE_URL is set, against
+the same schema as the Express API (database/init.sql), so both services
+can share one database. Methods mirror LoanStore but are coroutines.
+
+The pool is bounded by the same DB_* settings as api/db.js. asyncpg
+prepares and caches each statement per connection, so the hot lookups
+(loan by id, payments by loan, the (loan_id, week) check) are planned once.
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from metrics import DB_QUERY_SECONDS, DB_SLOW_QUERIES, statement_label
+from store import check_weeks
+
+try:
+    import asyncpg
+except ImportError:  # only needed when DATABASE_URL is set
+    asyncpg = None
+
+
+LOAN_BY_ID = "SELECT * FROM loans WHERE id = $1"
+PAYMENTS_BY_LOAN = "SELECT * FROM payments WHERE loan_id = $1 ORDER BY week"
+PAYMENT_BY_LOAN_WEEK = "SELECT * FROM payments WHERE loan_id = $1 AND week = $2"
+DATA_VERSION = "SELECT version FROM data_version"
+VERSION_HORIZON = "SELECT version, deleted_horizon FROM data_version"
+DELETED_SINCE = "SELECT row_id FROM deleted_rows WHERE table_name = $1 AND version > $2 ORDER BY row_id"
+
+BULK_INSERT = """
+    INSERT INTO payments (loan_id, week, amount, date)
+    SELECT * FROM unnest($1::int[], $2::int[], $3::numeric[], $4::date[])
+    ON CONFLICT (loan_id, week) DO NOTHING
+    RETURNING *
+"""
+
+BULK_EXISTING = """
+    SELECT p.* FROM payments p
+    JOIN unnest($1::int[], $2::int[]) AS k(loan_id, week)
+      ON p.loan_id = k.loan_id AND p.week = k.week
+"""
+
+# Shared with the Express API: functions and views defined in database/init.sql
+DUE_INSTALLMENTS = "SELECT * FROM due_installments($1, $2, $3, $4, $5)"
+PORTFOLIO = "SELECT * FROM portfolio_totals"
+TOP_BORROWERS = "SELECT * FROM loan_totals ORDER BY total_amount DESC LIMIT $1"
+EXPORT_LOANS = "SELECT * FROM loan_export ORDER BY loan_id"
+EXPORT_WEEKS = "SELECT * FROM installment_export($1)"
+
+# Rows pulled per round trip from the export cursor
+EXPORT_PREFETCH = 1000
+
+# Each export holds a connection of its own (outside DB_POOL_MAX) for as long
+# as the download takes, so only this many run at once
+EXPORT_MAX_CONCURRENT = int(os.environ.get("EXPORT_MAX_CONCURRENT", 2))
+
+# Statements at least this slow are logged with their SQL
+SLOW_QUERY_MS = int(os.environ.get("DB_SLOW_QUERY_MS", 200))
+
+logger = logging.getLogger(__name__)
+
+
+def _money(value):
+    return round(float(value), 2)
+
+def _log_query(record):
+    """asyncpg query logger: time every statement and log the slow ones."""
+    label = statement_label(record.query)
+    DB_QUERY_SECONDS.observe((label,), record.elapsed)
+    if record.elapsed * 1000 >= SLOW_QUERY_MS:
+        DB_SLOW_QUERIES.inc((label,))
+        logger.warning("Slow query (%.1f ms): %s", record.elapsed * 1000, " ".join(record.query.split())[:500])
+
+async def _init_connection(conn):
+    conn.add_query_logger(_log_query)
+
+
+class PgStore:
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.pool = None
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+    async def open(self):
+        if asyncpg is None:
+            raise RuntimeError("asyncpg is required when DATABASE_URL is set (pip install asyncpg)")
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=int(os.environ.get("DB_POOL_MIN", 1)),
+            max_size=int(os.environ.get("DB_POOL_MAX", 10)),
+            max_inactive_connection_lifetime=int(os.environ.get("DB_IDLE_TIMEOUT_MS", 30000)) / 1000,
+            timeout=int(os.environ.get("DB_CONNECT_TIMEOUT_MS", 5000)) / 1000,
+            server_settings={"statement_timeout": os.environ.get("DB_STATEMENT_TIMEOUT_MS", "15000")},
+            init=_init_connection,
+        )
+
+    async def close(self):
+        await self.pool.close()
+
+    @asynccontextmanager
+    async def connection(self):
+        """Check out a pooled connection, recording how long the wait was."""
+        start = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            wait = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            yield conn
+
+    async def fetch(self, sql, *args):
+        async with self.connection() as conn:
+            return [dict(row) for row in await conn.fetch(sql, *args)]
+
+    async def fetchrow(self, sql, *args):
+        async with self.connection() as conn:
+            row = await conn.fetchrow(sql, *args)
+            return dict(row) if row is not None else None
+
+    def stats(self):
+        size = self.pool.get_size()
+        idle = self.pool.get_idle_size()
+        return {
+            "backend": "postgres",
+            "pool": {
+                "max": self.pool.get_max_size(),
+                "total": size,
+                "active": size - idle,
+                "idle": idle,
+                "checkouts": self.checkouts,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            },
+        }
+
+    # ----------------------------
+    # Versions
+    # ----------------------------
+    async def data_version(self):
+        """Bumped by database triggers on every transaction writing loans or payments."""
+        async with self.connection() as conn:
+            return await conn.fetchval(DATA_VERSION)
+
+    async def changes_since(self, table, since_version):
+        current = await self.fetchrow(VERSION_HORIZON)
+        version = current["version"]
+        # Older than the tombstones still kept: deletions may be missing
+        if since_version > version or since_version < current["deleted_horizon"]:
+            return None
+        # table is "loans" or "payments", never user input
+        rows = await self.fetch(f"SELECT * FROM {table} WHERE version > $1 ORDER BY id", since_version)
+        deleted = [row["row_id"] for row in await self.fetch(DELETED_SINCE, table, since_version)]
+        return version, rows, deleted
+
+    # ----------------------------
+    # Loans
+    # ----------------------------
+    async def get_loan(self, loan_id):
+        return await self.fetchrow(LOAN_BY_ID, loan_id)
+
+    async def add_loan(self, loan_dict):
+        return await self.fetchrow(
+            "INSERT INTO loans (borrower_id, borrower, amount, interest, weeks, start_date) "
+            "VALUES ($1, $2, $3, $4, $5, $6) RETURNING *",
+            loan_dict["borrower_id"], loan_dict["borrower"], loan_dict["amount"],
+            loan_dict["interest"], loan_dict["weeks"], loan_dict["start_date"])
+
+    async def delete_loan(self, loan_id):
+        # Payments go with the loan (ON DELETE CASCADE)
+        return await self.fetchrow("DELETE FROM loans WHERE id = $1 RETURNING *", loan_id)
+
+    async def query_loans(self, after_id=None, limit=None, borrower_id=None, q=None,
+                          start_from=None, start_to=None, ids=None):
+        conditions = []
+        args = []
+
+        def arg(value):
+            args.append(value)
+            return f"${len(args)}"
+
+        if after_id is not None:
+            conditions.append(f"id < {arg(after_id)}")
+        if borrower_id is not None:
+            conditions.append(f"borrower_id = {arg(borrower_id)}")
+        if q:
+            term = arg(f"%{q.strip()}%")
+            conditions.append(f"(borrower_id ILIKE {term} OR borrower ILIKE {term} OR id::text LIKE {term})")
+        if start_from is not None:
+            conditions.append(f"start_date >= {arg(start_from)}")
+        if start_to is not None:
+            conditions.append(f"start_date <= {arg(start_to)}")
+        if ids is not None:
+            conditions.append(f"id = ANY({arg(list(ids))}::int[])")
+
+        sql = "SELECT * FROM loans"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id DESC"
+        if limit is not None:
+            sql += f" LIMIT {arg(limit)}"
+        return await self.fetch(sql, *args)
+
+    # ----------------------------
+    # Payments
+    # ----------------------------
+    async def payments_for_loan(self, loan_id):
+        return await self.fetch(PAYMENTS_BY_LOAN, loan_id)
+
+    async def query_payments(self, after_id=None, limit=None, loan_ids=None, q=None,
+                             date_from=None, date_to=None):
+        if loan_ids is not None and len(loan_ids) == 1 and after_id is None and limit is None \
+                and not q and date_from is None and date_to is None:
+            return await self.payments_for_loan(loan_ids[0])
+
+        conditions = []
+        args = []
+
+        def arg(value):
+            args.append(value)
+            return f"${len(args)}"
+
+        if after_id is not None:
+            conditions.append(f"id > {arg(after_id)}")
+        if loan_ids is not None:
+            conditions.append(f"loan_id = ANY({arg(list(loan_ids))}::int[])")
+        if q:
+            term = arg(f"%{q.strip()}%")
+            conditions.append("loan_id IN (SELECT l.id FROM loans l WHERE l.borrower_id ILIKE "
+                              f"{term} OR l.borrower ILIKE {term} OR l.id::text LIKE {term})")
+        if date_from is not None:
+            conditions.append(f"date >= {arg(date_from)}")
+        if date_to is not None:
+            conditions.append(f"date <= {arg(date_to)}")
+
+        sql = "SELECT * FROM payments"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id"
+        if limit is not None:
+            sql += f" LIMIT {arg(limit)}"
+        return await self.fetch(sql, *args)
+
+    async def add_payment(self, payment_dict):
+        async with self.connection() as conn:
+            while True:
+                row = await conn.fetchrow(
+                    "INSERT INTO payments (loan_id, week, amount, date) VALUES ($1, $2, $3, $4) "
+                    "ON CONFLICT (loan_id, week) DO NOTHING RETURNING *",
+                    payment_dict["loan_id"], payment_dict["week"], payment_dict["amount"], payment_dict["date"])
+                if row is not None:
+                    return dict(row), True
+                existing = await conn.fetchrow(PAYMENT_BY_LOAN_WEEK, payment_dict["loan_id"], payment_dict["week"])
+                if existing is not None:
+                    return dict(existing), False
+                # The conflicting payment was deleted in between; the week is free again
+
+    async def add_payments(self, payment_dicts):
+        """Insert a batch in one transaction. Returns ``(inserted, rows)``,
+        or None (writing nothing) if any payment refers to a missing loan.
+        Raises ValueError (writing nothing) if a week is outside its loan."""
+        loan_ids = [p["loan_id"] for p in payment_dicts]
+        weeks = [p["week"] for p in payment_dicts]
+        async with self.connection() as conn:
+            async with conn.transaction():
+                found = await conn.fetch(
+                    "SELECT id, weeks FROM loans WHERE id = ANY($1::int[])", list(set(loan_ids)))
+                if len(found) != len(set(loan_ids)):
+                    return None
+                check_weeks(payment_dicts, {row["id"]: row for row in found})
+                rows = await conn.fetch(BULK_INSERT, loan_ids, weeks,
+                                        [p["amount"] for p in payment_dicts],
+                                        [p["date"] for p in payment_dicts])
+                inserted = len(rows)
+                if inserted != len(payment_dicts):
+                    rows = await conn.fetch(BULK_EXISTING, loan_ids, weeks)
+                return inserted, [dict(row) for row in rows]
+
+    async def delete_payment(self, payment_id):
+        return await self.fetchrow("DELETE FROM payments WHERE id = $1 RETURNING *", payment_id)
+
+    async def delete_payments(self, payment_ids):
+        rows = await self.fetch("DELETE FROM payments WHERE id = ANY($1::int[]) RETURNING id", list(payment_ids))
+        return [row["id"] for row in rows]
+
+    # ----------------------------
+    # Export
+    # ----------------------------
+    def exports_full(self):
+        """True while EXPORT_MAX_CONCURRENT exports are streaming."""
+        return self.export_slots.locked()
+
+    async def export_rows(self, view, today):
+        """Stream export rows through a server-side cursor, EXPORT_PREFETCH at a time.
+
+        The cursor stays open until the client has downloaded everything, so
+        it runs on a dedicated connection rather than tying up the pool.
+        """
+        async with self.export_slots:
+            conn = await asyncpg.connect(
+                self.dsn,
+                timeout=int(os.environ.get("DB_CONNECT_TIMEOUT_MS", 5000)) / 1000,
+                server_settings={"statement_timeout": os.environ.get("DB_STATEMENT_TIMEOUT_MS", "15000")},
+            )
+            try:
+                await _init_connection(conn)
+                async with conn.transaction():
+                    if view == "loans":
+                        cursor = conn.cursor(EXPORT_LOANS, prefetch=EXPORT_PREFETCH)
+                    else:
+                        cursor = conn.cursor(EXPORT_WEEKS, today, prefetch=EXPORT_PREFETCH)
+                    async for row in cursor:
+                        yield dict(row)
+            finally:
+                await conn.close()
+
+    # ----------------------------
+    # Schedule
+    # ----------------------------
+    async def due_installments(self, until, q=None, borrower_id=None, limit=100, offset=0):
+        rows = await self.fetch(DUE_INSTALLMENTS, until, q.strip() if q else None, borrower_id, limit, offset)
+        total = rows[0]["total_count"] if rows else 0
+        total_amount = _money(rows[0]["total_amount"]) if rows else 0.0
+        for row in rows:
+            del row["total_count"], row["total_amount"]
+        return rows, total, total_amount
+
+    # ----------------------------
+    # Aggregates
+    # ----------------------------
+    async def summary(self, top=10):
+        totals = await self.fetchrow(PORTFOLIO)
+        portfolio = {key: value if isinstance(value, int) else _money(value) for key, value in totals.items()}
+        portfolio["principal_outstanding"] = _money(totals["total_principal"] - totals["principal_received"])
+        portfolio["interest_outstanding"] = _money(totals["total_interest"] - totals["interest_received"])
+        portfolio["unpaid_installments"] = totals["scheduled_installments"] - totals["paid_installments"]
+        top_borrowers = []
+        for loan in await self.fetch(TOP_BORROWERS, top):
+            loan["outstanding_amount"] = _money(loan["total_amount"] - loan["paid_amount"])
+            for key in ("total_amount", "amount_collected", "paid_amount"):
+                loan[key] = _money(loan[key])
+            loan["is_completed"] = loan["paid_weeks"] >= loan["weeks"]
+            top_borrowers.append(loan)
+        return {"portfolio": portfolio, "top_borrowers": top_borrowers}
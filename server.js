@@ -3,24 +3,22 @@ const path = require('path');
 const cors = require('cors');
 const session = require('express-session');
 const pgSession = require('connect-pg-simple')(session);
-const { Pool } = require('pg');
 require('dotenv').config({ path: '.env.local' });
+const { pool, poolStats } = require('./api/db.js');
+const { cacheStats } = require('./api/cache.js');
+const metrics = require('./api/metrics.js');
 
 const app = express();
 const PORT = process.env.PORT || 3000;
 
-// Database pool for sessions
-const pool = new Pool({
-  connectionString: process.env.DATABASE_URL,
-  ssl: false
-});
-
 // Middleware
+app.use(metrics.instrument);
 app.use(cors({
   origin: `http://localhost:${PORT}`,
   credentials: true
 }));
-app.use(express.json());
+app.use(express.json({ limit: '5mb' }));
+app.use(express.text({ type: 'application/x-ndjson', limit: '50mb' }));
 
 // Session middleware
 app.use(session({
@@ -46,6 +44,9 @@ const paymentsHandler = require('./api/payments-local.js');
 const authHandler = require('./api/auth-local.js');
 const usersHandler = require('./api/users-local.js');
 const borrowerSummaryHandler = require('./api/borrower-summary-local.js');
+const installmentsHandler = require('./api/installments-local.js');
+const summaryHandler = require('./api/summary-local.js');
+const exportHandler = require('./api/export-local.js');
 
 // Authentication middleware
 function requireAuth(req, res, next) {
@@ -85,10 +86,13 @@ function requireUserOrAdmin(req, res, next) {
 app.use('/api/auth', (req, res) => authHandler.handler(req, res));
 app.use('/api/users', (req, res) => usersHandler.handler(req, res));
 app.use('/api/borrower-summary', requireAuth, (req, res) => borrowerSummaryHandler.handler(req, res));
+app.use('/api/installments', requireAuth, (req, res) => installmentsHandler.handler(req, res));
 
 // Protected routes - loans and payments require admin access
 app.use('/api/loans', requireAdmin, (req, res) => loansHandler.handler(req, res));
 app.use('/api/payments', requireAdmin, (req, res) => paymentsHandler.handler(req, res));
+app.use('/api/summary', requireAdmin, (req, res) => summaryHandler.handler(req, res));
+app.use('/api/export', requireAdmin, (req, res) => exportHandler.handler(req, res));
 
 // Serve HTML files with authentication checks
 app.get('/', requireAuth, (req, res) => {
@@ -128,10 +132,17 @@ app.get('/health', (req, res) => {
   res.json({ 
     status: 'OK', 
     timestamp: new Date().toISOString(),
-    environment: 'local-development' 
+    environment: 'local-development',
+    db_pool: poolStats(),
+    response_cache: cacheStats()
   });
 });
 
+// Route latency, payload sizes and database timings for Prometheus
+app.get('/metrics', (req, res) => {
+  res.type('text/plain; version=0.0.4').send(metrics.render());
+});
+
 // Start server
 app.listen(PORT, () => {
   console.log(`🚀 Loan Management System running on http://localhost:${PORT}`);
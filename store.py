@@ -0,0 +1,514 @@
+"""In-memory store for the FastAPI service (main.py).
+
+Loans and payments are kept in dicts keyed by id, plus a secondary
+``loan_id -> {week: payment}`` index, so lookups, the (loan_id, week)
+uniqueness check and cascade deletes never scan the whole book.
+
+Each loan's first unpaid week is tracked as it is paid and unpaid, and
+loans with a week left to pay are kept sorted by that week's due date
+(``due_queue``). The installments due by a date come from the queue prefix
+due by then, merged lazily in due date order, so a page never builds the
+rest of the due set.
+
+Per-loan and portfolio aggregates (paid weeks, amount collected, principal
+and interest received) are updated on every write, so summaries never
+re-count payments.
+
+Every write bumps ``version`` and stamps it on the row. A bounded
+changelog, ordered by version, answers "what changed since version N"
+(``changes_since``) without scanning the book.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from datetime import timedelta
+from heapq import heappop, heappush, heapreplace, nlargest
+
+# Writes remembered for changes_since; older deltas need a full reload
+CHANGELOG_LIMIT = 100_000
+
+
+def _total_due(loan):
+    return loan["amount"] * (1 + loan["interest"] / 100)
+
+
+def _matches(loan, term):
+    """Case-insensitive substring match on borrower id, name or loan id."""
+    return (term in loan["borrower_id"].lower()
+            or term in loan["borrower"].lower()
+            or term in str(loan["id"]))
+
+
+def check_weeks(payment_dicts, loans):
+    """Raise ValueError if a payment's week is outside 1..weeks of its loan
+    (``loans`` maps loan id to loan)."""
+    for payment in payment_dicts:
+        weeks = loans[payment["loan_id"]]["weeks"]
+        if not 1 <= payment["week"] <= weeks:
+            raise ValueError(f"Week {payment['week']} is outside loan {payment['loan_id']} (weeks 1-{weeks})")
+
+
+class LoanStore:
+    def __init__(self):
+        self.loans = {}          # loan id -> loan dict
+        self.payments = {}       # payment id -> payment dict
+        self.loan_payments = {}  # loan id -> {week: payment dict}
+        self.first_unpaid = {}   # loan id -> first unpaid week (weeks + 1 once fully paid)
+        self.due_queue = []      # sorted (due date of first unpaid week, loan id), loans with weeks to pay
+        self.due_cache = None    # (version, until, q, borrower id) and the due loans found for them
+        self.borrower_loans = {} # borrower id -> set of loan ids
+        self.loan_collected = {} # loan id -> sum of payment amounts
+        self.totals = {
+            "loans": 0,
+            "completed_loans": 0,
+            "total_principal": 0.0,
+            "total_interest": 0.0,
+            "principal_received": 0.0,
+            "interest_received": 0.0,
+            "amount_collected": 0.0,
+            "paid_installments": 0,
+            "scheduled_installments": 0,
+        }
+        self.loan_id_counter = 1
+        self.payment_id_counter = 1
+        self.version = 0
+        self.changelog = OrderedDict()  # (table, row id) -> version of its last write, oldest first
+        self.changelog_horizon = 0      # changes at or before this version were dropped
+
+    def stats(self):
+        return {"backend": "memory", "loans": len(self.loans), "payments": len(self.payments),
+                "version": self.version}
+
+    def data_version(self):
+        return self.version
+
+    def _record_change(self, table, row_id):
+        self.version += 1
+        key = (table, row_id)
+        self.changelog.pop(key, None)
+        self.changelog[key] = self.version
+        if len(self.changelog) > CHANGELOG_LIMIT:
+            self.changelog_horizon = self.changelog.popitem(last=False)[1]
+        return self.version
+
+    def changes_since(self, table, since_version):
+        """Rows of ``table`` ("loans" or "payments") written after
+        ``since_version`` and the ids deleted since, as ``(version, rows,
+        deleted_ids)``. None when that history is no longer known."""
+        if since_version < self.changelog_horizon or since_version > self.version:
+            return None
+        current = self.loans if table == "loans" else self.payments
+        rows = []
+        deleted = []
+        for (changed_table, row_id), version in reversed(self.changelog.items()):
+            if version <= since_version:
+                break
+            if changed_table != table:
+                continue
+            row = current.get(row_id)
+            if row is None:
+                deleted.append(row_id)
+            else:
+                rows.append(row)
+        rows.sort(key=lambda row: row["id"])
+        deleted.sort()
+        return self.version, rows, deleted
+
+    # ----------------------------
+    # Loans
+    # ----------------------------
+    def list_loans(self):
+        return list(self.loans.values())
+
+    def get_loan(self, loan_id):
+        return self.loans.get(loan_id)
+
+    def add_loan(self, loan_dict):
+        loan_dict["id"] = self.loan_id_counter
+        self.loan_id_counter += 1
+        loan_dict["version"] = self._record_change("loans", loan_dict["id"])
+        self.loans[loan_dict["id"]] = loan_dict
+        self.loan_payments[loan_dict["id"]] = {}
+        self._move_first_unpaid(loan_dict["id"], 1)
+        self.borrower_loans.setdefault(loan_dict["borrower_id"], set()).add(loan_dict["id"])
+        self.loan_collected[loan_dict["id"]] = 0.0
+        self._count_loan(loan_dict, 1)
+        return loan_dict
+
+    def delete_loan(self, loan_id):
+        """Remove a loan and its payments. Returns the loan, or None."""
+        loan = self.loans.get(loan_id)
+        if loan is None:
+            return None
+        for payment in list(self.loan_payments[loan_id].values()):
+            self.delete_payment(payment["id"])
+        del self.loan_payments[loan_id]
+        del self.loan_collected[loan_id]
+        self.borrower_loans[loan["borrower_id"]].discard(loan_id)
+        self._count_loan(loan, -1)
+        self._move_first_unpaid(loan_id, None)
+        del self.loans[loan_id]
+        self._record_change("loans", loan_id)
+        return loan
+
+    def query_loans(self, after_id=None, limit=None, borrower_id=None, q=None,
+                    start_from=None, start_to=None, ids=None):
+        """Filtered loans, newest first, resuming below ``after_id``.
+
+        Ids only grow, so the keyset walk probes ids downwards instead of
+        sorting the book; ``ids`` and ``borrower_id`` narrow the walk to
+        their own (small) candidate sets.
+        """
+        if ids is not None:
+            candidates = sorted(ids, reverse=True)
+        elif borrower_id is not None:
+            candidates = sorted(self.borrower_loans.get(borrower_id, ()), reverse=True)
+        else:
+            first = self.loan_id_counter - 1 if after_id is None else after_id - 1
+            candidates = range(first, 0, -1)
+
+        term = q.lower() if q else None
+        rows = []
+        for loan_id in candidates:
+            if after_id is not None and loan_id >= after_id:
+                continue
+            loan = self.loans.get(loan_id)
+            if loan is None:
+                continue
+            if borrower_id is not None and loan["borrower_id"] != borrower_id:
+                continue
+            if term and not _matches(loan, term):
+                continue
+            if start_from is not None and loan["start_date"] < start_from:
+                continue
+            if start_to is not None and loan["start_date"] > start_to:
+                continue
+            rows.append(loan)
+            if limit is not None and len(rows) == limit:
+                break
+        return rows
+
+    # ----------------------------
+    # Payments
+    # ----------------------------
+    def list_payments(self):
+        return list(self.payments.values())
+
+    def get_payment(self, payment_id):
+        return self.payments.get(payment_id)
+
+    def payments_for_loan(self, loan_id):
+        return list(self.loan_payments.get(loan_id, {}).values())
+
+    def query_payments(self, after_id=None, limit=None, loan_ids=None, q=None,
+                       date_from=None, date_to=None):
+        """Filtered payments in id order, resuming above ``after_id``.
+
+        ``q`` keeps the payments of the loans ``query_loans(q=...)`` finds.
+        """
+        if q:
+            term = q.lower()
+            matched = [loan["id"] for loan in self.loans.values() if _matches(loan, term)]
+            loan_ids = matched if loan_ids is None else set(loan_ids).intersection(matched)
+        if loan_ids is not None:
+            candidates = sorted(payment["id"] for loan_id in loan_ids
+                                for payment in self.loan_payments.get(loan_id, {}).values())
+        else:
+            first = 1 if after_id is None else after_id + 1
+            candidates = range(first, self.payment_id_counter)
+
+        rows = []
+        for payment_id in candidates:
+            if after_id is not None and payment_id <= after_id:
+                continue
+            payment = self.payments.get(payment_id)
+            if payment is None:
+                continue
+            if date_from is not None and payment["date"] < date_from:
+                continue
+            if date_to is not None and payment["date"] > date_to:
+                continue
+            rows.append(payment)
+            if limit is not None and len(rows) == limit:
+                break
+        return rows
+
+    def find_payment(self, loan_id, week):
+        return self.loan_payments.get(loan_id, {}).get(week)
+
+    def add_payment(self, payment_dict):
+        """Insert a payment unless (loan_id, week) is already paid.
+
+        Returns ``(payment, created)``; when the week is already paid the
+        existing payment is returned with ``created=False``.
+        """
+        weeks = self.loan_payments[payment_dict["loan_id"]]
+        existing = weeks.get(payment_dict["week"])
+        if existing is not None:
+            return existing, False
+        payment_dict["id"] = self.payment_id_counter
+        self.payment_id_counter += 1
+        payment_dict["version"] = self._record_change("payments", payment_dict["id"])
+        self.payments[payment_dict["id"]] = payment_dict
+        weeks[payment_dict["week"]] = payment_dict
+        self._count_payment(payment_dict, 1)
+        first = self.first_unpaid[payment_dict["loan_id"]]
+        if payment_dict["week"] == first:
+            while first in weeks:
+                first += 1
+            self._move_first_unpaid(payment_dict["loan_id"], first)
+        return payment_dict, True
+
+    def add_payments(self, payment_dicts):
+        """Insert a batch. Returns ``(inserted, rows)``, or None (writing
+        nothing) if any payment refers to a missing loan. Raises ValueError
+        (writing nothing) if a week is outside its loan."""
+        if any(p["loan_id"] not in self.loans for p in payment_dicts):
+            return None
+        check_weeks(payment_dicts, self.loans)
+        inserted = 0
+        rows = []
+        for payment_dict in payment_dicts:
+            payment, created = self.add_payment(payment_dict)
+            inserted += created
+            rows.append(payment)
+        return inserted, rows
+
+    def delete_payments(self, payment_ids):
+        """Remove payments by id. Returns the ids that existed."""
+        return [payment_id for payment_id in payment_ids if self.delete_payment(payment_id) is not None]
+
+    def delete_payment(self, payment_id):
+        """Remove a single payment. Returns the payment, or None."""
+        payment = self.payments.pop(payment_id, None)
+        if payment is None:
+            return None
+        self._count_payment(payment, -1)
+        del self.loan_payments[payment["loan_id"]][payment["week"]]
+        if 1 <= payment["week"] < self.first_unpaid[payment["loan_id"]]:
+            self._move_first_unpaid(payment["loan_id"], payment["week"])
+        self._record_change("payments", payment_id)
+        return payment
+
+    def _move_first_unpaid(self, loan_id, week):
+        """Set a loan's first unpaid week and re-file it in ``due_queue``;
+        ``week=None`` drops the loan."""
+        loan = self.loans[loan_id]
+        old = self.first_unpaid.pop(loan_id, None)
+        if old is not None and old <= loan["weeks"]:
+            key = (loan["start_date"] + timedelta(days=7 * old), loan_id)
+            del self.due_queue[bisect_left(self.due_queue, key)]
+        if week is not None:
+            self.first_unpaid[loan_id] = week
+            if week <= loan["weeks"]:
+                insort(self.due_queue, (loan["start_date"] + timedelta(days=7 * week), loan_id))
+
+    # ----------------------------
+    # Aggregates
+    # ----------------------------
+    def _count_loan(self, loan, sign):
+        totals = self.totals
+        totals["loans"] += sign
+        totals["total_principal"] += sign * loan["amount"]
+        totals["total_interest"] += sign * loan["amount"] * loan["interest"] / 100
+        totals["scheduled_installments"] += sign * loan["weeks"]
+
+    def _count_payment(self, payment, sign):
+        """Apply (sign=1) or revert (sign=-1) a payment while it is linked
+        into ``loan_payments``."""
+        loan = self.loans[payment["loan_id"]]
+        paid_before = len(self.loan_payments[loan["id"]]) - 1
+        totals = self.totals
+        totals["paid_installments"] += sign
+        totals["amount_collected"] += sign * payment["amount"]
+        totals["principal_received"] += sign * loan["amount"] / loan["weeks"]
+        totals["interest_received"] += sign * loan["amount"] * loan["interest"] / 100 / loan["weeks"]
+        self.loan_collected[loan["id"]] += sign * payment["amount"]
+        # A loan is completed once its paid weeks reach its term
+        if paid_before < loan["weeks"] <= paid_before + 1:
+            totals["completed_loans"] += sign
+
+    def loan_balance(self, loan_id):
+        loan = self.loans[loan_id]
+        paid_weeks = len(self.loan_payments[loan_id])
+        total_amount = _total_due(loan)
+        paid_amount = total_amount * paid_weeks / loan["weeks"]
+        return {
+            **loan,
+            "total_amount": round(total_amount, 2),
+            "paid_weeks": paid_weeks,
+            "amount_collected": round(self.loan_collected[loan_id], 2),
+            "paid_amount": round(paid_amount, 2),
+            "outstanding_amount": round(total_amount - paid_amount, 2),
+            "is_completed": paid_weeks >= loan["weeks"],
+        }
+
+    def summary(self, top=10):
+        """Portfolio totals plus the ``top`` loans by total amount due."""
+        totals = self.totals
+        portfolio = {key: round(value, 2) for key, value in totals.items()}
+        portfolio["principal_outstanding"] = round(totals["total_principal"] - totals["principal_received"], 2)
+        portfolio["interest_outstanding"] = round(totals["total_interest"] - totals["interest_received"], 2)
+        portfolio["unpaid_installments"] = totals["scheduled_installments"] - totals["paid_installments"]
+        top_loans = nlargest(top, self.loans.values(), key=_total_due)
+        return {
+            "portfolio": portfolio,
+            "top_borrowers": [self.loan_balance(loan["id"]) for loan in top_loans],
+        }
+
+    # ----------------------------
+    # Export
+    # ----------------------------
+    def export_rows(self, view, today):
+        """Rows for /export, by loan id: one per loan (``view="loans"``) or
+        one per scheduled week with its payment (``view="weeks"``).
+
+        A generator walking the id range, so it holds one loan at a time and
+        tolerates writes between rows.
+        """
+        for loan_id in range(1, self.loan_id_counter):
+            loan = self.loans.get(loan_id)
+            if loan is None:
+                continue
+            installment = round(_total_due(loan) / loan["weeks"], 2)
+            paid = self.loan_payments[loan_id]
+            if view == "loans":
+                remaining = loan["weeks"] - len(paid)
+                yield {
+                    "loan_id": loan_id,
+                    "borrower_id": loan["borrower_id"],
+                    "borrower": loan["borrower"],
+                    "amount": loan["amount"],
+                    "start_date": loan["start_date"],
+                    "interest": loan["interest"],
+                    "weeks": loan["weeks"],
+                    "paid_weeks": len(paid),
+                    "remaining_weeks": remaining,
+                    "total_paid": round(installment * len(paid), 2),
+                    "remaining_amount": round(installment * remaining, 2),
+                    "installment": installment,
+                    "next_due_date": (loan["start_date"] + timedelta(days=7 * (len(paid) + 1))
+                                      if remaining > 0 else None),
+                    "status": "Completed" if remaining <= 0 else "In Progress",
+                }
+                continue
+            for week in range(1, loan["weeks"] + 1):
+                due_date = loan["start_date"] + timedelta(days=7 * week)
+                payment = paid.get(week)
+                yield {
+                    "loan_id": loan_id,
+                    "borrower_id": loan["borrower_id"],
+                    "borrower": loan["borrower"],
+                    "amount": loan["amount"],
+                    "interest": loan["interest"],
+                    "weeks": loan["weeks"],
+                    "start_date": loan["start_date"],
+                    "week": week,
+                    "due_date": due_date,
+                    "installment": installment,
+                    "status": "paid" if payment else "due" if due_date <= today else "upcoming",
+                    "paid_amount": payment["amount"] if payment else None,
+                    "paid_date": payment.get("date") if payment else None,
+                }
+
+    # ----------------------------
+    # Schedule
+    # ----------------------------
+    def due_installments(self, until, q=None, borrower_id=None, limit=100, offset=0):
+        """Unpaid installments due on or before ``until``, sorted by due date.
+
+        Week N of a loan falls due on ``start_date + 7 * N`` days. Only loans
+        in the ``due_queue`` prefix due by ``until`` have such weeks; the page
+        is merged from their unpaid weeks with a heap, stopping once it is
+        full. Returns ``(rows, total, total_amount)`` for the requested page.
+        """
+        candidates, installments, total, total_amount = self._due_loans(until, q, borrower_id)
+
+        # Loans enter the heap in queue order, only once their first unpaid
+        # week could be the next row
+        page = []
+        heap = []
+        pending = iter(candidates)
+        candidate = next(pending, None)
+        while len(page) < offset + limit:
+            while candidate is not None and (not heap or candidate[:2] <= heap[0][:2]):
+                weeks = self._unpaid_weeks(*candidate[1:])
+                heappush(heap, (*next(weeks), weeks))
+                candidate = next(pending, None)
+            if not heap:
+                break
+            due_date, loan_id, week, weeks = heap[0]
+            page.append((due_date, loan_id, week))
+            following = next(weeks, None)
+            if following is None:
+                heappop(heap)
+            else:
+                heapreplace(heap, (*following, weeks))
+
+        rows = []
+        for due_date, loan_id, week in page[offset:]:
+            loan = self.loans[loan_id]
+            rows.append({
+                "loan_id": loan_id,
+                "borrower_id": loan["borrower_id"],
+                "borrower": loan["borrower"],
+                "amount": loan["amount"],
+                "installment": installments[loan_id],
+                "week": week,
+                "due_date": due_date,
+            })
+        return rows, total, total_amount
+
+    def _due_loans(self, until, q, borrower_id):
+        """The loans with installments due by ``until`` as ``(first due date,
+        loan id, first unpaid week, last due week)`` in queue order, their
+        installments, and the due count and amount.
+
+        The last result is kept until the next write, so paging through one
+        search counts the due set once.
+        """
+        key = (self.version, until, q, borrower_id)
+        if self.due_cache is not None and self.due_cache[0] == key:
+            return self.due_cache[1]
+
+        if borrower_id is not None:
+            queued = sorted((self.loans[loan_id]["start_date"] + timedelta(days=7 * self.first_unpaid[loan_id]),
+                             loan_id)
+                            for loan_id in self.borrower_loans.get(borrower_id, ())
+                            if self.first_unpaid[loan_id] <= self.loans[loan_id]["weeks"])
+        else:
+            queued = self.due_queue
+        queued = queued[:bisect_right(queued, (until, float("inf")))]
+
+        term = q.lower() if q else None
+        candidates = []
+        installments = {}
+        total = 0
+        total_amount = 0.0
+        for due_date, loan_id in queued:
+            loan = self.loans[loan_id]
+            if term and not _matches(loan, term):
+                continue
+            first = self.first_unpaid[loan_id]
+            last = min(loan["weeks"], (until - loan["start_date"]).days // 7)
+            paid = self.loan_payments[loan_id]
+            # Weeks before ``first`` are all paid; paid weeks after it are prepayments
+            if len(paid) == first - 1:
+                count = last - first + 1
+            else:
+                count = sum(week not in paid for week in range(first, last + 1))
+            installment = installments[loan_id] = round(_total_due(loan) / loan["weeks"], 2)
+            total += count
+            total_amount += count * installment
+            candidates.append((due_date, loan_id, first, last))
+
+        result = candidates, installments, total, round(total_amount, 2)
+        self.due_cache = (key, result)
+        return result
+
+    def _unpaid_weeks(self, loan_id, first, last):
+        """``(due date, loan id, week)`` of a loan's unpaid weeks ``first..last``."""
+        start_date = self.loans[loan_id]["start_date"]
+        paid = self.loan_payments[loan_id]
+        for week in range(first, last + 1):
+            if week not in paid:
+                yield start_date + timedelta(days=7 * week), loan_id, week
@@ -0,0 +1,58 @@
+"""Tests for the FastAPI service (main.py) on the in-memory store."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.pop("DATABASE_URL", None)
+os.environ.pop("DATA_DIR", None)
+
+from fastapi.testclient import TestClient
+
+import main
+
+LOAN = {"borrower_id": "B1", "borrower": "Borrower 1", "amount": 1000, "interest": 10,
+        "weeks": 4, "start_date": "2024-01-01"}
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.mark.parametrize("weeks", [0, -3])
+def test_loan_needs_at_least_one_week(client, weeks):
+    loans_before = len(main.store.loans)
+    assert client.post("/loans", json={**LOAN, "weeks": weeks}).status_code == 422
+    assert len(main.store.loans) == loans_before
+    assert client.get("/summary").status_code == 200
+
+
+def test_bulk_delete_asks_for_payment_ids(client):
+    response = client.request("DELETE", "/payments/bulk", json={"payments": [1]})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Array of payment ids required"
+
+
+@pytest.mark.parametrize("field, length", [("borrower_id", 51), ("borrower", 256)])
+def test_loan_names_fit_the_database_columns(client, field, length):
+    assert client.post("/loans", json={**LOAN, field: "x" * length}).status_code == 422
+
+
+def test_bulk_delete_rejects_booleans(client):
+    response = client.request("DELETE", "/payments/bulk", json={"ids": [True]})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("week", [0, 5, 99])
+def test_payment_week_must_be_in_the_loan(client, week):
+    loan = client.post("/loans", json=LOAN).json()
+    summary = client.get("/summary").json()
+    payment = {"loan_id": loan["id"], "week": week, "amount": 10}
+    assert client.post("/payments", json=payment).status_code in (400, 422)
+    bulk = client.post("/payments/bulk", json={"payments": [{**payment, "week": 1}, payment]})
+    assert bulk.status_code == 400
+    assert client.get("/summary").json() == summary
@@ -0,0 +1,117 @@
+"""Tests for the in-memory LoanStore (store.py)."""
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import LoanStore
+
+
+def make_loan(borrower_id="B1", weeks=10, start_date=date(2024, 1, 1), amount=1000.0, interest=10.0):
+    return {"borrower_id": borrower_id, "borrower": f"Borrower {borrower_id}", "amount": amount,
+            "interest": interest, "weeks": weeks, "start_date": start_date}
+
+
+def make_payment(loan, week, amount=None):
+    return {"loan_id": loan["id"], "week": week,
+            "amount": amount if amount is not None else round(loan["amount"] * 1.1 / loan["weeks"], 2),
+            "date": loan["start_date"] + timedelta(days=7 * week)}
+
+
+def brute_force_due(store, until, q=None, borrower_id=None):
+    """Every unpaid week due by ``until``, in the order due_installments pages them."""
+    rows = []
+    for loan in store.loans.values():
+        if borrower_id is not None and loan["borrower_id"] != borrower_id:
+            continue
+        if q and q.lower() not in f'{loan["borrower_id"]} {loan["borrower"]}'.lower() \
+                and q.lower() not in str(loan["id"]):
+            continue
+        for week in range(1, loan["weeks"] + 1):
+            due_date = loan["start_date"] + timedelta(days=7 * week)
+            if due_date <= until and week not in store.loan_payments[loan["id"]]:
+                rows.append((due_date, loan["id"], week))
+    rows.sort()
+    return rows
+
+
+def random_store(seed):
+    rng = random.Random(seed)
+    store = LoanStore()
+    loans = [store.add_loan(make_loan(f"B{rng.randrange(5)}", weeks=rng.randrange(1, 15),
+                                      start_date=date(2024, 1, 1) + timedelta(days=rng.randrange(120))))
+             for _ in range(40)]
+    payments = []
+    for _ in range(300):
+        loan = rng.choice(loans)
+        payment, created = store.add_payment(make_payment(loan, rng.randrange(1, loan["weeks"] + 1)))
+        if created:
+            payments.append(payment)
+    for payment in rng.sample(payments, len(payments) // 3):
+        store.delete_payment(payment["id"])
+    for loan in rng.sample(loans, 5):
+        store.delete_loan(loan["id"])
+    return store
+
+
+def test_due_installments_matches_brute_force():
+    for seed in range(5):
+        store = random_store(seed)
+        for until in (date(2024, 1, 1), date(2024, 2, 15), date(2024, 5, 1), date(2025, 1, 1)):
+            for q, borrower_id in ((None, None), ("b3", None), (None, "B2"), ("1", None)):
+                expected = brute_force_due(store, until, q=q, borrower_id=borrower_id)
+                for limit, offset in ((1000, 0), (7, 0), (7, 14), (5, len(expected))):
+                    rows, total, total_amount = store.due_installments(
+                        until, q=q, borrower_id=borrower_id, limit=limit, offset=offset)
+                    assert [(row["due_date"], row["loan_id"], row["week"]) for row in rows] \
+                        == expected[offset:offset + limit]
+                    assert total == len(expected)
+                    assert total_amount == round(sum(
+                        round(store.loans[loan_id]["amount"] * 1.1 / store.loans[loan_id]["weeks"], 2)
+                        for _, loan_id, _ in expected), 2)
+
+
+def test_due_queue_tracks_first_unpaid_week():
+    store = LoanStore()
+    loan = store.add_loan(make_loan(weeks=3))
+    assert store.first_unpaid[loan["id"]] == 1
+    week_2, _ = store.add_payment(make_payment(loan, 2))
+    assert store.first_unpaid[loan["id"]] == 1
+    week_1, _ = store.add_payment(make_payment(loan, 1))
+    assert store.first_unpaid[loan["id"]] == 3
+    store.add_payment(make_payment(loan, 3))
+    assert store.first_unpaid[loan["id"]] == 4
+    assert store.due_queue == []
+    store.delete_payment(week_2["id"])
+    assert store.due_queue == [(loan["start_date"] + timedelta(days=14), loan["id"])]
+    store.delete_loan(loan["id"])
+    assert store.due_queue == [] and store.first_unpaid == {}
+
+
+def test_completed_loans_follows_last_week():
+    store = LoanStore()
+    loan = store.add_loan(make_loan(weeks=2))
+    store.add_payment(make_payment(loan, 1))
+    assert store.totals["completed_loans"] == 0
+    last, _ = store.add_payment(make_payment(loan, 2))
+    assert store.totals["completed_loans"] == 1
+    store.delete_payment(last["id"])
+    assert store.totals["completed_loans"] == 0
+    store.add_payment(make_payment(loan, 2))
+    assert store.totals["completed_loans"] == 1
+    store.delete_loan(loan["id"])
+    assert store.totals["completed_loans"] == 0
+
+
+def test_query_payments_by_search_term():
+    store = LoanStore()
+    alice = store.add_loan(make_loan("A7", weeks=3))
+    bob = store.add_loan(make_loan("B8", weeks=3))
+    for loan in (alice, bob):
+        store.add_payment(make_payment(loan, 1))
+        store.add_payment(make_payment(loan, 2))
+    assert {p["loan_id"] for p in store.query_payments(q="a7")} == {alice["id"]}
+    assert {p["loan_id"] for p in store.query_payments(q="borrower")} == {alice["id"], bob["id"]}
+    assert store.query_payments(q="a7", loan_ids=[bob["id"]]) == []
@@ -0,0 +1,235 @@
+"""Tests for the durable store (walstore.py): log replay, torn tails, snapshots."""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import walstore
+from test_store import make_loan, make_payment
+from walstore import WalStore
+
+
+def fill(store, n_loans=5, weeks=6, paid_weeks=3):
+    loans = [store.add_loan(make_loan(borrower_id=f"B{i}", weeks=weeks)) for i in range(n_loans)]
+    for loan in loans:
+        for week in range(1, paid_weeks + 1):
+            store.add_payment(make_payment(loan, week))
+    return loans
+
+
+def state(store):
+    """Everything a reopened store must reproduce (totals summed in another order)."""
+    totals = {key: round(value, 6) for key, value in store.totals.items()}
+    collected = {loan_id: round(value, 6) for loan_id, value in store.loan_collected.items()}
+    return (store.loans, dict(store.payments.items()), collected, store.first_unpaid, store.due_queue,
+            totals, store.loan_id_counter, store.payment_id_counter)
+
+
+def reopen(store):
+    """Open the files of ``store`` as after a crash: no snapshot on the way out."""
+    store.sync()
+    return WalStore(store.data_dir).open()
+
+
+def test_log_replays_after_reopen(tmp_path):
+    store = WalStore(str(tmp_path)).open()
+    loans = fill(store)
+    store.delete_payment(store.loan_payments[loans[0]["id"]][2]["id"])
+    store.delete_loan(loans[1]["id"])
+    reopened = reopen(store)
+    assert state(reopened) == state(store)
+    assert reopened.lsn == store.lsn
+    # New rows continue the id sequences
+    assert reopened.add_loan(make_loan())["id"] == store.add_loan(make_loan())["id"]
+
+
+def test_torn_tail_is_cut_off(tmp_path):
+    store = WalStore(str(tmp_path)).open()
+    fill(store)
+    store.sync()
+    expected = state(store)
+    valid_size = os.path.getsize(store.wal_path)
+    # A crash in the middle of appending the next record
+    with open(store.wal_path, "ab") as f:
+        f.write(walstore.RECORD_HEADER.pack(64, 0) + b"\x01" * 10)
+
+    reopened = WalStore(str(tmp_path)).open()
+    assert state(reopened) == expected
+    assert os.path.getsize(reopened.wal_path) == valid_size
+    loan = reopened.add_loan(make_loan())
+    assert loan["id"] in reopen(reopened).loans
+
+
+def test_snapshot_plus_log(tmp_path):
+    store = WalStore(str(tmp_path)).open()
+    loans = fill(store)
+    store.snapshot()
+    assert os.path.getsize(store.wal_path) == 0
+    store.add_payment(make_payment(loans[2], 4))
+    store.delete_loan(loans[3]["id"])
+    fill(store, n_loans=2)
+    reopened = reopen(store)
+    assert state(reopened) == state(store)
+    assert reopened.records_since_snapshot == store.records_since_snapshot
+
+
+def test_bulk_writes_are_one_record(tmp_path):
+    store = WalStore(str(tmp_path)).open()
+    loan = store.add_loan(make_loan(weeks=6))
+    lsn = store.lsn
+    # Week 1 twice: the duplicate is returned but logged once
+    created, payments = store.add_payments([make_payment(loan, week) for week in (1, 2, 3, 1)])
+    assert created == 3 and store.lsn == lsn + 1
+    store.delete_payments([payment["id"] for payment in payments[:2]])
+    assert store.lsn == lsn + 2
+    reopened = reopen(store)
+    assert state(reopened) == state(store)
+    assert sorted(reopened.loan_payments[loan["id"]]) == [3]
+
+
+def test_commit_shares_fsyncs(tmp_path, monkeypatch):
+    store = WalStore(str(tmp_path)).open()
+    loan = store.add_loan(make_loan(weeks=50))
+    store.sync()
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(walstore.os, "fsync", lambda fd: fsyncs.append(fd) or real_fsync(fd))
+
+    async def writer(week):
+        store.add_payment(make_payment(loan, week))
+        await store.commit()
+        assert store.synced_lsn >= store.lsn - 50
+
+    async def main():
+        await asyncio.gather(*(writer(week) for week in range(1, 51)))
+
+    asyncio.run(main())
+    assert store.synced_lsn == store.lsn
+    assert 1 <= len(fsyncs) < 50
+
+
+def test_checkpoint_while_writing(tmp_path):
+    store = WalStore(str(tmp_path)).open()
+    loans = fill(store)
+
+    async def main():
+        checkpoint = asyncio.ensure_future(store.checkpoint())
+        while not os.path.exists(store.prev_wal_path):
+            await asyncio.sleep(0)
+        # Logged to the new wal.log while the snapshot is written
+        store.add_payment(make_payment(loans[4], 5))
+        store.delete_loan(loans[0]["id"])
+        await checkpoint
+        await store.commit()
+
+    asyncio.run(main())
+    assert not os.path.exists(store.prev_wal_path)
+    assert store.records_since_snapshot == 2
+    reopened = reopen(store)
+    assert state(reopened) == state(store)
+
+
+def test_unfinished_checkpoint_is_folded_on_open(tmp_path):
+    store = WalStore(str(tmp_path)).open()
+    loans = fill(store)
+    store.snapshot()
+    store.add_payment(make_payment(loans[0], 4))
+    # Crash after starting a new log, before the snapshot replaced the old one
+    store._rotate_log()
+    store.add_payment(make_payment(loans[1], 4))
+    reopened = reopen(store)
+    assert state(reopened) == state(store)
+    assert not os.path.exists(reopened.prev_wal_path)
+    assert state(reopen(reopened)) == state(store)
+
+
+def test_rejected_record_leaves_store_unchanged(tmp_path):
+    store = WalStore(str(tmp_path)).open()
+    loans = fill(store, n_loans=1)
+    expected = state(store)
+    with pytest.raises(ValueError):
+        store.add_loan(make_loan(borrower_id="B" * 70_000))
+    with pytest.raises(ValueError):
+        store.add_payments([make_payment(loans[0], 4), make_payment(loans[0], 99)])
+    assert state(store) == expected
+    store.add_payment(make_payment(loans[0], 4))
+    assert state(reopen(store)) == state(store)
+
+
+def test_failed_write_leaves_store_and_log_unchanged(tmp_path, monkeypatch):
+    store = WalStore(str(tmp_path)).open()
+    loans = fill(store, n_loans=2)
+    expected = state(store)
+    log_size = os.path.getsize(store.wal_path)
+    real_write = os.write
+
+    def torn_write(fd, data):
+        real_write(fd, data[:7])
+        raise OSError("disk full")
+
+    monkeypatch.setattr(walstore.os, "write", torn_write)
+    for write in (lambda: store.add_loan(make_loan()),
+                  lambda: store.add_payment(make_payment(loans[0], 5)),
+                  lambda: store.add_payments([make_payment(loans[1], 5)]),
+                  lambda: store.delete_payments([store.loan_payments[loans[1]["id"]][1]["id"]]),
+                  lambda: store.delete_loan(loans[0]["id"])):
+        with pytest.raises(OSError):
+            write()
+    assert state(store) == expected
+    assert os.path.getsize(store.wal_path) == log_size
+
+    monkeypatch.setattr(walstore.os, "write", real_write)
+    store.add_payment(make_payment(loans[0], 5))
+    assert state(reopen(store)) == state(store)
+
+
+def test_snapshot_rows_are_built_on_first_use(tmp_path):
+    store = WalStore(str(tmp_path)).open()
+    loans = fill(store)
+    store.snapshot()
+    store.close()
+    expected = state(WalStore(str(tmp_path)).open())
+
+    reopened = WalStore(str(tmp_path)).open()
+    assert len(reopened.payments) == 15 and dict.__len__(reopened.payments) == 0
+    payment = expected[1][7]
+    assert reopened.get_payment(payment["id"]) == payment
+    assert dict.__len__(reopened.payments) == 3  # only that payment's loan
+    assert reopened.get_payment(10_000) is None
+    reopened.delete_payment(expected[1][12]["id"])
+    reopened.add_payment(make_payment(loans[3], 4))
+    assert [p["id"] for p in reopened.query_payments(limit=4)] == [1, 2, 3, 4]
+    _, rows, deleted = reopened.changes_since("payments", reopened.version - 2)
+    assert deleted == [expected[1][12]["id"]] and [row["week"] for row in rows] == [4]
+
+    # Rows never built are copied from the old snapshot's columns
+    reopened.snapshot()
+    assert dict.__len__(reopened.payments) < len(reopened.payments)
+    assert state(reopen(reopened)) == state(reopened)
+
+
+def test_version_1_snapshot_still_opens(tmp_path):
+    store = WalStore(str(tmp_path)).open()
+    fill(store)
+    store.delete_payment(2)
+    store.snapshot()
+    store.close()
+    expected = state(WalStore(str(tmp_path)).open())
+
+    # Drop the columns version 2 added: first unpaid week and the id index
+    with open(store.snapshot_path, "rb") as f:
+        data = f.read()
+    header = walstore.SNAPSHOT_HEADER.unpack_from(data)
+    n_loans, n_payments, payment_counter = header[5], header[6], header[4]
+    first_unpaid = walstore.SNAPSHOT_HEADER.size + 7 * 8 * n_loans + 3 * 8 * n_payments + 3 * 4 * n_loans
+    id_index = first_unpaid + 4 * n_loans + 2 * 4 * n_payments
+    blob = id_index + 4 * (payment_counter - 1)
+    data = (walstore.SNAPSHOT_MAGIC_V1 + data[8:first_unpaid] + data[first_unpaid + 4 * n_loans:id_index]
+            + data[blob:])
+    with open(store.snapshot_path, "wb") as f:
+        f.write(data)
+
+    assert state(WalStore(str(tmp_path)).open()) == expected
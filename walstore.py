@@ -0,0 +1,717 @@
+"""Durable in-memory store for the FastAPI service (main.py).
+
+WalStore is a LoanStore that survives restarts without a database server:
+
+* every loan/payment mutation is appended to ``wal.log`` as a framed,
+  CRC-checked binary record. A bulk insert or delete is a single record, so
+  a crash replays all of it or none of it;
+* ``commit()`` waits until the log is fsynced past the caller's writes. The
+  fsync runs in a worker thread and every writer that arrives while one is
+  in flight shares the next one (group commit), so a write is acknowledged
+  only once it is durable, without one fsync per write or a blocked loop;
+* ``checkpoint()`` writes the whole book to ``snapshot.bin`` in a compact
+  columnar layout (fixed-width arrays plus one string blob) from a worker
+  thread, then drops the log it covers. The log is first renamed to
+  ``wal.prev`` and a new one started, so writes go on meanwhile; rows are
+  never modified in place, so copying the row lists up front is enough.
+  ``snapshot()`` does the same synchronously (shutdown, tools);
+* ``open()`` maps the snapshot, builds the loan indexes straight from its
+  columns and replays only log records newer than it. A torn record at the
+  tail (crash mid-write) ends replay and is cut off. Payment rows stay in
+  the mapped columns until first used: the rows of a loan are built as a
+  whole on first lookup, and the next snapshot copies the columns of loans
+  never touched as they are.
+
+Every record carries a log sequence number (LSN) and the snapshot stores the
+last LSN it contains, so records that are both in a snapshot and still in a
+log (a crash mid-checkpoint) are never applied twice.
+
+Opening a snapshot of 1M payments plus 10k logged writes takes about 0.3 s
+(bench/wal_bench.py).
+"""
+import asyncio
+import gc
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_right
+from datetime import date, timedelta
+
+from store import LoanStore, check_weeks
+
+ADD_LOAN = 1
+DELETE_LOAN = 2
+ADD_PAYMENT = 3
+DELETE_PAYMENT = 4
+ADD_PAYMENTS = 5     # a bulk insert: count, then PAYMENT_RECORDs
+DELETE_PAYMENTS = 6  # a bulk delete: count, then ID_RECORDs
+
+RECORD_HEADER = struct.Struct("<II")   # body length, crc32(body)
+BODY_HEADER = struct.Struct("<QB")     # lsn, op
+LOAN_RECORD = struct.Struct("<qiidd")  # id, start ordinal, weeks, amount, interest
+PAYMENT_RECORD = struct.Struct("<qqidi")  # id, loan id, week, amount, date ordinal (0 = none)
+ID_RECORD = struct.Struct("<q")
+COUNT = struct.Struct("<I")
+STRING_LENGTH = struct.Struct("<H")
+
+SNAPSHOT_MAGIC = b"LOANSNP2"
+SNAPSHOT_MAGIC_V1 = b"LOANSNP1"  # no first unpaid week or id index columns
+SNAPSHOT_HEADER = struct.Struct("<8sqqqqqqq")  # magic, lsn, data version, loan/payment id counters, loans, payments, blob size
+
+
+def _pack_string(value):
+    data = value.encode()
+    if len(data) > 0xFFFF:
+        raise ValueError(f"{len(data)} bytes is too long to log (at most 65535)")
+    return STRING_LENGTH.pack(len(data)) + data
+
+
+def _unpack_string(body, offset):
+    (length,) = STRING_LENGTH.unpack_from(body, offset)
+    offset += STRING_LENGTH.size
+    return body[offset:offset + length].decode(), offset + length
+
+
+def _pack_payment(payment_id, payment):
+    paid_on = payment.get("date")
+    return PAYMENT_RECORD.pack(payment_id, payment["loan_id"], payment["week"], payment["amount"],
+                               paid_on.toordinal() if paid_on else 0)
+
+
+def _column(typecode, values):
+    """array(typecode, values), converted in slices: one C call over a
+    million values would hold the GIL against the event loop throughout."""
+    column = array(typecode)
+    for start in range(0, len(values), 1 << 16):
+        column.extend(values[start:start + (1 << 16)])
+    return column
+
+
+def _fsync_dir(path):
+    dir_fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class WalStore(LoanStore):
+    def __init__(self, data_dir, snapshot_every=100_000):
+        super().__init__()
+        self.data_dir = data_dir
+        self.wal_path = os.path.join(data_dir, "wal.log")
+        self.prev_wal_path = os.path.join(data_dir, "wal.prev")
+        self.snapshot_path = os.path.join(data_dir, "snapshot.bin")
+        self.snapshot_every = snapshot_every
+        self.lsn = 0
+        self.synced_lsn = 0          # the log is fsynced up to here
+        self.records_since_snapshot = 0
+        self.fd = None
+        self.log_size = 0            # end of the last complete record in wal.log
+        self._retired_fds = []       # rotated logs still to fsync and close
+        self._dir_dirty = False      # a log was renamed or created since the last fsync
+        self._flushing = None        # the fsync in flight, shared by every commit() waiting on it
+        self._checkpointing = None   # the checkpoint in flight
+        self._muted = False          # True while replaying or cascading
+        # Payment rows of the loaded snapshot are built on first use
+        self.loan_payments = _LazyLoanPayments()
+        self.payments = self.loan_payments.payments
+
+    def stats(self):
+        return {**super().stats(), "backend": "memory+wal",
+                "wal": {"lsn": self.lsn, "synced_lsn": self.synced_lsn,
+                        "records_since_snapshot": self.records_since_snapshot,
+                        "checkpointing": self._checkpointing is not None}}
+
+    # ----------------------------
+    # Lifecycle
+    # ----------------------------
+    def open(self):
+        """Load the snapshot, replay the logs and start appending."""
+        os.makedirs(self.data_dir, exist_ok=True)
+        snapshot_lsn = self._load_snapshot() if os.path.exists(self.snapshot_path) else 0
+        self.lsn = snapshot_lsn
+        # wal.prev is left by a checkpoint that did not finish
+        if os.path.exists(self.prev_wal_path):
+            self._replay(self.prev_wal_path, snapshot_lsn)
+        valid_end = self._replay(self.wal_path, snapshot_lsn) if os.path.exists(self.wal_path) else 0
+        self.fd = os.open(self.wal_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        os.ftruncate(self.fd, valid_end)  # drop a torn tail record, if any
+        os.lseek(self.fd, valid_end, os.SEEK_SET)
+        self.log_size = valid_end
+        self.synced_lsn = self.lsn
+        if os.path.exists(self.prev_wal_path):
+            self.snapshot()
+        return self
+
+    def sync(self):
+        """fsync the log now, on the calling thread."""
+        self._fsync([self.fd, *self._retired_fds], self._dir_dirty)
+        self._retired_fds = []
+        self._dir_dirty = False
+        self.synced_lsn = self.lsn
+
+    def close(self):
+        if self.fd is not None:
+            self.sync()
+            os.close(self.fd)
+            self.fd = None
+
+    async def shutdown(self):
+        """Finish a checkpoint in flight, snapshot what was logged since and close."""
+        if self._checkpointing is not None:
+            await asyncio.shield(self._checkpointing)
+        if self.records_since_snapshot:
+            await self.checkpoint()
+        self.close()
+
+    # ----------------------------
+    # Log
+    # ----------------------------
+    def _append(self, op, payload):
+        """Write one record. Mutations call this before changing memory, so
+        a write that fails leaves the store as it was."""
+        if self._muted:
+            return
+        body = BODY_HEADER.pack(self.lsn + 1, op) + payload
+        record = RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+        try:
+            if os.write(self.fd, record) != len(record):
+                raise OSError("short write to wal.log")
+        except OSError:
+            # Later records must not land behind a partial one
+            os.ftruncate(self.fd, self.log_size)
+            os.lseek(self.fd, self.log_size, os.SEEK_SET)
+            raise
+        self.log_size += len(record)
+        self.lsn += 1
+        self.records_since_snapshot += 1
+
+    async def commit(self):
+        """Wait until every record appended so far is fsynced.
+
+        One fsync is in flight at a time, in a worker thread; callers that
+        arrive meanwhile wait for it to finish and then share the next one.
+        """
+        target = self.lsn
+        while self.synced_lsn < target:
+            if self._flushing is None:
+                self._flushing = asyncio.ensure_future(self._flush())
+            await asyncio.shield(self._flushing)
+
+    async def _flush(self):
+        try:
+            lsn = self.lsn
+            fds, self._retired_fds = [self.fd, *self._retired_fds], []
+            dir_dirty, self._dir_dirty = self._dir_dirty, False
+            await asyncio.to_thread(self._fsync, fds, dir_dirty)
+            self.synced_lsn = max(self.synced_lsn, lsn)
+        finally:
+            self._flushing = None
+
+    def _fsync(self, fds, dir_dirty):
+        """fsync the current log (first) and close the retired ones after it."""
+        for fd in fds:
+            os.fsync(fd)
+        for fd in fds[1:]:
+            os.close(fd)
+        if dir_dirty:
+            _fsync_dir(self.data_dir)
+
+    def _rotate_log(self):
+        """Start a new wal.log, keeping the current one as wal.prev until a
+        snapshot covers it. Unsynced records in it are fsynced by the next commit."""
+        os.rename(self.wal_path, self.prev_wal_path)
+        self._retired_fds.append(self.fd)
+        self.fd = os.open(self.wal_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.log_size = 0
+        self._dir_dirty = True
+        self.records_since_snapshot = 0
+
+    def _replay(self, path, snapshot_lsn):
+        """Apply log records newer than the snapshot; returns the end of the last valid record."""
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        self._muted = True
+        try:
+            while offset + RECORD_HEADER.size <= len(data):
+                length, crc = RECORD_HEADER.unpack_from(data, offset)
+                body = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+                if len(body) < length or zlib.crc32(body) != crc:
+                    break
+                lsn, op = BODY_HEADER.unpack_from(body)
+                if lsn > snapshot_lsn:
+                    self._apply(op, body, BODY_HEADER.size)
+                    self.lsn = lsn
+                    self.records_since_snapshot += 1
+                offset += RECORD_HEADER.size + length
+        finally:
+            self._muted = False
+        return offset
+
+    def _apply(self, op, body, offset):
+        if op == ADD_LOAN:
+            loan_id, start, weeks, amount, interest = LOAN_RECORD.unpack_from(body, offset)
+            borrower_id, offset = _unpack_string(body, offset + LOAN_RECORD.size)
+            borrower, offset = _unpack_string(body, offset)
+            self.loan_id_counter = loan_id
+            self.add_loan({"borrower_id": borrower_id, "borrower": borrower, "amount": amount,
+                           "interest": interest, "weeks": weeks, "start_date": date.fromordinal(start)})
+        elif op == DELETE_LOAN:
+            self.delete_loan(ID_RECORD.unpack_from(body, offset)[0])
+        elif op in (ADD_PAYMENT, ADD_PAYMENTS):
+            count = 1
+            if op == ADD_PAYMENTS:
+                (count,) = COUNT.unpack_from(body, offset)
+                offset += COUNT.size
+            end = offset + count * PAYMENT_RECORD.size
+            for payment_id, loan_id, week, amount, paid_on in PAYMENT_RECORD.iter_unpack(body[offset:end]):
+                self.payment_id_counter = payment_id
+                self.add_payment({"loan_id": loan_id, "week": week, "amount": amount,
+                                  "date": date.fromordinal(paid_on) if paid_on else None})
+        elif op == DELETE_PAYMENT:
+            self.delete_payment(ID_RECORD.unpack_from(body, offset)[0])
+        elif op == DELETE_PAYMENTS:
+            (count,) = COUNT.unpack_from(body, offset)
+            offset += COUNT.size
+            for (payment_id,) in ID_RECORD.iter_unpack(body[offset:offset + count * ID_RECORD.size]):
+                self.delete_payment(payment_id)
+
+    # ----------------------------
+    # Logged mutations
+    # ----------------------------
+    # Each record is packed and written before memory changes, with the id
+    # the row is about to get; the LoanStore call that follows is muted, so
+    # its own nested mutations are not logged again.
+    def _unlogged(self, method, *args):
+        muted, self._muted = self._muted, True
+        try:
+            return method(*args)
+        finally:
+            self._muted = muted
+
+    def add_loan(self, loan_dict):
+        self._append(ADD_LOAN, LOAN_RECORD.pack(
+            self.loan_id_counter, loan_dict["start_date"].toordinal(), loan_dict["weeks"],
+            loan_dict["amount"], loan_dict["interest"])
+            + _pack_string(loan_dict["borrower_id"]) + _pack_string(loan_dict["borrower"]))
+        return self._unlogged(super().add_loan, loan_dict)
+
+    def delete_loan(self, loan_id):
+        if loan_id not in self.loans:
+            return None
+        # The cascade to payments is implied by the loan record
+        self._append(DELETE_LOAN, ID_RECORD.pack(loan_id))
+        return self._unlogged(super().delete_loan, loan_id)
+
+    def add_payment(self, payment_dict):
+        if payment_dict["loan_id"] in self.loans \
+                and self.find_payment(payment_dict["loan_id"], payment_dict["week"]) is None:
+            self._append(ADD_PAYMENT, _pack_payment(self.payment_id_counter, payment_dict))
+        return self._unlogged(super().add_payment, payment_dict)
+
+    def add_payments(self, payment_dicts):
+        if all(payment["loan_id"] in self.loans for payment in payment_dicts):
+            check_weeks(payment_dicts, self.loans)
+            # The payments the batch will create, in order; a week paid
+            # twice in one batch is created once
+            created = {}
+            for payment in payment_dicts:
+                key = payment["loan_id"], payment["week"]
+                if key not in created and self.find_payment(*key) is None:
+                    created[key] = _pack_payment(self.payment_id_counter + len(created), payment)
+            if created:
+                self._append(ADD_PAYMENTS, COUNT.pack(len(created)) + b"".join(created.values()))
+        return self._unlogged(super().add_payments, payment_dicts)
+
+    def delete_payment(self, payment_id):
+        if self.payments.get(payment_id) is not None:
+            self._append(DELETE_PAYMENT, ID_RECORD.pack(payment_id))
+        return self._unlogged(super().delete_payment, payment_id)
+
+    def delete_payments(self, payment_ids):
+        existing = [payment_id for payment_id in dict.fromkeys(payment_ids)
+                    if self.payments.get(payment_id) is not None]
+        if existing:
+            self._append(DELETE_PAYMENTS, COUNT.pack(len(existing)) + array("q", existing).tobytes())
+        return self._unlogged(super().delete_payments, payment_ids)
+
+    # ----------------------------
+    # Snapshots
+    # ----------------------------
+    async def checkpoint(self):
+        """Snapshot the book from a worker thread while writes go on, then
+        drop the log it covers. Waits for a checkpoint already in flight
+        instead of starting a second one."""
+        if self._checkpointing is None:
+            self._checkpointing = asyncio.ensure_future(self._checkpoint())
+        await asyncio.shield(self._checkpointing)
+
+    async def _checkpoint(self):
+        try:
+            state = self._snapshot_state()
+            # After a failed checkpoint wal.prev is still needed; the snapshot
+            # then covers part of wal.log instead, and the next one drops it
+            if not os.path.exists(self.prev_wal_path):
+                self._rotate_log()
+            await asyncio.to_thread(self._write_snapshot, state)
+            os.unlink(self.prev_wal_path)
+        finally:
+            self._checkpointing = None
+
+    def snapshot(self):
+        """Write the whole book to snapshot.bin and truncate the log."""
+        self._write_snapshot(self._snapshot_state())
+        # Everything logged is in the snapshot now
+        os.ftruncate(self.fd, 0)
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        self.log_size = 0
+        if os.path.exists(self.prev_wal_path):
+            os.unlink(self.prev_wal_path)
+        self.sync()
+        self.records_since_snapshot = 0
+
+    def _snapshot_state(self):
+        """What a snapshot holds, copied on the event loop. Rows are never
+        modified after they are added, so copying the row lists is enough;
+        payments never built from the loaded snapshot are copied from its
+        columns by the writer."""
+        unbuilt = self.loan_payments.rows
+        return {
+            "lsn": self.lsn,
+            "version": self.version,
+            "loan_id_counter": self.loan_id_counter,
+            "payment_id_counter": self.payment_id_counter,
+            "loans": list(self.loans.values()),
+            "payments": list(dict.values(self.payments)),
+            "unbuilt": (unbuilt, dict(unbuilt.spans)) if unbuilt is not None else (None, {}),
+            "loan_collected": dict(self.loan_collected),
+            "first_unpaid": dict(self.first_unpaid),
+        }
+
+    def _write_snapshot(self, state):
+        """Write ``state`` to snapshot.bin (safe to run in a worker thread)."""
+        loans = state["loans"]
+        unbuilt, spans = state["unbuilt"]
+        # Payments are written grouped by loan, so a loan's rows are one
+        # contiguous slice of each column. Placing them by counts rather than
+        # one list per loan keeps the collector from sweeping the whole book
+        # (under the GIL) halfway through
+        built = dict.fromkeys(state["loan_collected"], 0)
+        for payment in state["payments"]:
+            built[payment["loan_id"]] += 1
+        slot, end = {}, 0
+        for loan in loans:
+            slot[loan["id"]] = end
+            end += built[loan["id"]]
+        placed = [None] * end
+        for payment in state["payments"]:
+            placed[slot[payment["loan_id"]]] = payment
+            slot[payment["loan_id"]] += 1
+
+        payment_ids, amounts, versions, weeks, dates = \
+            array("q"), array("d"), array("q"), array("i"), array("i")
+        paid = []
+        end = 0
+        for loan in loans:
+            span = spans.get(loan["id"])
+            if span is not None:
+                # Never built: copy the loaded snapshot's slice as is
+                first, last = span
+                for column, source in ((payment_ids, unbuilt.ids), (amounts, unbuilt.amounts),
+                                       (versions, unbuilt.versions), (weeks, unbuilt.weeks),
+                                       (dates, unbuilt.dates)):
+                    column.frombytes(source[first:last].cast("B"))
+                paid.append(last - first)
+                continue
+            start, end = end, end + built[loan["id"]]
+            rows = placed[start:end]
+            payment_ids.extend([p["id"] for p in rows])
+            amounts.extend([p["amount"] for p in rows])
+            versions.extend([p["version"] for p in rows])
+            weeks.extend([p["week"] for p in rows])
+            dates.extend([p["date"].toordinal() if p.get("date") else 0 for p in rows])
+            paid.append(end - start)
+
+        blob = bytearray()
+        borrower_id_ends = []
+        borrower_ends = []
+        for loan in loans:
+            blob += loan["borrower_id"].encode()
+            borrower_id_ends.append(len(blob))
+            blob += loan["borrower"].encode()
+            borrower_ends.append(len(blob))
+
+        # 8-byte columns first, then 4-byte ones, then the string blob
+        columns = [
+            _column("q", [loan["id"] for loan in loans]),
+            _column("d", [loan["amount"] for loan in loans]),
+            _column("d", [loan["interest"] for loan in loans]),
+            _column("d", [state["loan_collected"][loan["id"]] for loan in loans]),
+            _column("q", [loan["version"] for loan in loans]),
+            _column("q", borrower_id_ends),
+            _column("q", borrower_ends),
+            payment_ids,
+            amounts,
+            versions,
+            _column("i", [loan["start_date"].toordinal() for loan in loans]),
+            _column("i", [loan["weeks"] for loan in loans]),
+            _column("i", paid),
+            _column("i", [state["first_unpaid"][loan["id"]] for loan in loans]),
+            weeks,
+            dates,
+            _id_index(payment_ids, state["payment_id_counter"]),
+        ]
+
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, state["lsn"], state["version"],
+                                         state["loan_id_counter"], state["payment_id_counter"],
+                                         len(loans), len(payment_ids), len(blob)))
+            for column in columns:
+                f.write(column.tobytes())
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        _fsync_dir(self.data_dir)
+
+    def _load_snapshot(self):
+        """Rebuild the store from the memory-mapped snapshot; returns its LSN."""
+        with open(self.snapshot_path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # The payment columns stay mapped until every row is built; the
+        # mapping outlives the file being replaced by a newer snapshot
+        view = memoryview(mapped)
+        # Thousands of new dicts would otherwise trigger pointless
+        # collections; nothing built here can form a cycle
+        gc.disable()
+        try:
+            return self._load_columns(view)
+        finally:
+            gc.enable()
+
+    def _load_columns(self, view):
+        magic, lsn, version, loan_counter, payment_counter, n_loans, n_payments, blob_size = \
+            SNAPSHOT_HEADER.unpack_from(view)
+        if magic not in (SNAPSHOT_MAGIC, SNAPSHOT_MAGIC_V1):
+            raise ValueError(f"{self.snapshot_path} is not a loan store snapshot")
+        offset = SNAPSHOT_HEADER.size
+
+        def column(fmt, count):
+            nonlocal offset
+            size = count * struct.calcsize(fmt)
+            values = view[offset:offset + size].cast(fmt)
+            offset += size
+            return values
+
+        # Loan columns become lists (a row per loan is built now); payment
+        # columns stay views into the mapping
+        loan_ids = column("q", n_loans).tolist()
+        loan_amounts = column("d", n_loans).tolist()
+        loan_interests = column("d", n_loans).tolist()
+        loan_collected = column("d", n_loans).tolist()
+        loan_versions = column("q", n_loans).tolist()
+        borrower_id_ends = column("q", n_loans).tolist()
+        borrower_ends = column("q", n_loans).tolist()
+        payment_ids = column("q", n_payments)
+        payment_amounts = column("d", n_payments)
+        payment_versions = column("q", n_payments)
+        loan_starts = column("i", n_loans).tolist()
+        loan_weeks = column("i", n_loans).tolist()
+        loan_paid = column("i", n_loans).tolist()
+        v1 = magic == SNAPSHOT_MAGIC_V1
+        first_unpaid = None if v1 else column("i", n_loans).tolist()
+        payment_weeks = column("i", n_payments)
+        payment_dates = column("i", n_payments)
+        # Snapshots from before the first unpaid week and id index columns
+        # get them computed here; the next snapshot stores them
+        by_id = _id_index(payment_ids, payment_counter) if v1 else column("i", payment_counter - 1)
+        blob = bytes(view[offset:offset + blob_size])
+
+        dates = {ordinal: date.fromordinal(ordinal) for ordinal in set(loan_starts)}
+        starts = [0, *borrower_ends[:-1]]
+        loans = [
+            {"borrower_id": blob[start:id_end].decode(), "borrower": blob[id_end:name_end].decode(),
+             "amount": amount, "interest": interest, "weeks": weeks, "start_date": dates[start_date],
+             "id": loan_id, "version": row_version}
+            for loan_id, amount, interest, start, id_end, name_end, start_date, weeks, row_version in zip(
+                loan_ids, loan_amounts, loan_interests, starts, borrower_id_ends, borrower_ends,
+                loan_starts, loan_weeks, loan_versions)
+        ]
+        rows = _SnapshotRows(payment_ids, payment_amounts, payment_versions, payment_weeks,
+                             payment_dates, by_id, loan_ids, loan_paid)
+        if v1:
+            first_unpaid = []
+            for loan_id in loan_ids:
+                first, end = rows.spans[loan_id]
+                paid_weeks = set(payment_weeks[first:end])
+                week = 1
+                while week in paid_weeks:
+                    week += 1
+                first_unpaid.append(week)
+
+        self.loans = dict(zip(loan_ids, loans))
+        self.loan_payments.rows = rows if n_payments or n_loans else None
+        self.loan_collected = dict(zip(loan_ids, loan_collected))
+        for loan in loans:
+            self.borrower_loans.setdefault(loan["borrower_id"], set()).add(loan["id"])
+        self.first_unpaid = dict(zip(loan_ids, first_unpaid))
+        self.due_queue = sorted((loan["start_date"] + timedelta(days=7 * first), loan["id"])
+                                for loan, first in zip(loans, first_unpaid) if first <= loan["weeks"])
+
+        interests = [amount * interest / 100 for amount, interest in zip(loan_amounts, loan_interests)]
+        self.totals.update({
+            "loans": n_loans,
+            "completed_loans": sum(paid >= weeks for paid, weeks in zip(loan_paid, loan_weeks)),
+            "total_principal": sum(loan_amounts),
+            "total_interest": sum(interests),
+            "principal_received": sum(amount * paid / weeks
+                                      for amount, paid, weeks in zip(loan_amounts, loan_paid, loan_weeks)),
+            "interest_received": sum(interest * paid / weeks
+                                     for interest, paid, weeks in zip(interests, loan_paid, loan_weeks)),
+            "amount_collected": sum(loan_collected),
+            "paid_installments": n_payments,
+            "scheduled_installments": sum(loan_weeks),
+        })
+        self.loan_id_counter = loan_counter
+        self.payment_id_counter = payment_counter
+        # Deletions before the snapshot are not kept, so older deltas reload in full
+        self.version = self.changelog_horizon = version
+        return lsn
+
+
+def _id_index(payment_ids, payment_id_counter):
+    """Position of every payment id below the counter in ``payment_ids``
+    (-1 for deleted ids), so a row is found by id without a dict of them all."""
+    index = array("i", [-1]) * (payment_id_counter - 1)
+    for position, payment_id in enumerate(payment_ids):
+        index[payment_id - 1] = position
+    return index
+
+
+class _SnapshotRows:
+    """Payment columns of a mapped snapshot. A loan's rows become dicts the
+    first time its payments are needed (``take``)."""
+
+    def __init__(self, ids, amounts, versions, weeks, dates, by_id, loan_ids, paid):
+        self.ids = ids
+        self.amounts = amounts
+        self.versions = versions
+        self.weeks = weeks
+        self.dates = dates
+        self.by_id = by_id
+        self.loan_ids = loan_ids
+        self.starts = []
+        self.spans = {}  # loan id -> (start, end) of the rows not built yet
+        end = 0
+        for loan_id, count in zip(loan_ids, paid):
+            self.starts.append(end)
+            self.spans[loan_id] = (end, end + count)
+            end += count
+        self.pending = end  # rows not built yet
+        self.paid_on = {0: None}  # date ordinal -> date
+
+    def take(self, loan_id):
+        """Build a loan's rows, or None if they were built already."""
+        span = self.spans.pop(loan_id, None)
+        if span is None:
+            return None
+        start, end = span
+        self.pending -= end - start
+        paid_on = self.paid_on
+        rows = []
+        for position in range(start, end):
+            ordinal = self.dates[position]
+            if ordinal not in paid_on:
+                paid_on[ordinal] = date.fromordinal(ordinal)
+            rows.append({"loan_id": loan_id, "week": self.weeks[position], "amount": self.amounts[position],
+                         "date": paid_on[ordinal], "id": self.ids[position],
+                         "version": self.versions[position]})
+        return rows
+
+    def loan_of(self, payment_id):
+        """The loan of a payment whose row is not built yet, else None."""
+        if not 1 <= payment_id <= len(self.by_id):
+            return None
+        position = self.by_id[payment_id - 1]
+        if position < 0:
+            return None
+        loan_id = self.loan_ids[bisect_right(self.starts, position) - 1]
+        return loan_id if loan_id in self.spans else None
+
+
+class _LazyLoanPayments(dict):
+    """loan id -> {week: payment dict}. Loans whose payments are still only
+    in the snapshot columns get their rows built on first access."""
+
+    def __init__(self):
+        super().__init__()
+        self.rows = None  # _SnapshotRows of the loaded snapshot, until all are built
+        self.payments = _LazyPayments(self)
+
+    def __missing__(self, loan_id):
+        built = self.rows.take(loan_id) if self.rows is not None else None
+        if built is None:
+            raise KeyError(loan_id)
+        dict.update(self.payments, ((payment["id"], payment) for payment in built))
+        weeks = self[loan_id] = {payment["week"]: payment for payment in built}
+        if not self.rows.spans:
+            self.rows = None  # releases the mapping
+        return weeks
+
+    def get(self, loan_id, default=None):
+        try:
+            return self[loan_id]
+        except KeyError:
+            return default
+
+    def build_all(self):
+        while self.rows is not None:
+            self[next(iter(self.rows.spans))]
+
+
+class _LazyPayments(dict):
+    """payment id -> payment dict, looked up through the snapshot's id index
+    (building the payment's loan) when the row is not built yet. Iterating
+    builds every row."""
+
+    def __init__(self, loan_payments):
+        super().__init__()
+        self.loan_payments = loan_payments
+
+    def __missing__(self, payment_id):
+        rows = self.loan_payments.rows
+        loan_id = rows.loan_of(payment_id) if rows is not None else None
+        if loan_id is None:
+            raise KeyError(payment_id)
+        self.loan_payments[loan_id]
+        return dict.__getitem__(self, payment_id)
+
+    def get(self, payment_id, default=None):
+        try:
+            return self[payment_id]
+        except KeyError:
+            return default
+
+    def __contains__(self, payment_id):
+        return self.get(payment_id) is not None
+
+    def pop(self, payment_id, *default):
+        self.get(payment_id)
+        return dict.pop(self, payment_id, *default)
+
+    def __len__(self):
+        rows = self.loan_payments.rows
+        return dict.__len__(self) + (rows.pending if rows is not None else 0)
+
+    def values(self):
+        self.loan_payments.build_all()
+        return dict.values(self)
+
+    def items(self):
+        self.loan_payments.build_all()
+        return dict.items(self)